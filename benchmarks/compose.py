@@ -0,0 +1,79 @@
+"""Folds random event streams through nested compositions of deciders.
+
+Compares the state-level `CombinedState.evolve` path with the class-level
+`ComposedDecider.evolve` path: both must reach the same state, at the same
+cost, for compositions nested `--depth` levels deep.
+"""
+
+import argparse
+import random
+import timeit
+
+from decider import compose_decider_aggregates
+from deciders.bulb import Bulb
+from deciders.cat import Cat
+from infra import fold
+
+
+def nested_decider(depth: int):
+    decider = Cat
+    for level in range(depth):
+        decider = compose_decider_aggregates(Cat if level % 2 else Bulb, decider)
+    return decider
+
+
+def random_events(decider, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    state, events = decider.initial_state(), []
+    commands = [
+        Cat.WakeUpCommand(),
+        Cat.GoToSleepCommand(),
+        Bulb.FitCommand(max_uses=count),
+        Bulb.SwitchOnCommand(),
+        Bulb.SwitchOffCommand(),
+    ]
+    while len(events) < count:
+        new_events = decider.decide(rng.choice(commands), state)
+        state = fold(decider.evolve, state, new_events)
+        events.extend(new_events)
+    return events
+
+
+def fingerprint(state) -> tuple:
+    if hasattr(state, "decider_x_state"):
+        return (fingerprint(state.decider_x_state), fingerprint(state.decider_y_state))
+    return (type(state).__qualname__, tuple(sorted(vars(state).items())))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for depth in args.depth:
+        decider = nested_decider(depth)
+        events = random_events(decider, args.events, seed=depth)
+        paths = {
+            "class-level": decider.evolve,
+            "state-level": lambda state, event: state.evolve(event),
+        }
+        results = {
+            name: fold(evolve, decider.initial_state(), events)
+            for name, evolve in paths.items()
+        }
+        assert len({fingerprint(state) for state in results.values()}) == 1
+        for name, evolve in paths.items():
+            best = min(
+                timeit.repeat(
+                    lambda: fold(evolve, decider.initial_state(), events),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            print(f"depth {depth}: {name:<12} {len(events) / best:>12.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
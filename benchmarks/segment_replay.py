@@ -0,0 +1,98 @@
+"""Bytes per event and replay speed of sealed segments against the event log.
+
+Records random bulb traffic in a `FileBasedEventStore`, seals it into
+segments with each available compression, then measures the size of every
+file and the time to open it and fold every stream from scratch.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+import segments
+from deciders.bulb import Bulb
+from infra import EventSourcingDecider, InMemoryDecider, fold
+from serializers import bulb_event_deserializer, bulb_event_serializer
+
+
+def record(store: EventSourcingDecider.FileBasedEventStore, bulbs: int, events: int):
+    rng = random.Random(0)
+    clock = itertools.count(1_700_000_000.0, 0.001)
+    store.clock = lambda: next(clock)
+    deciders = [InMemoryDecider(Bulb) for _ in range(bulbs)]
+    versions = [0] * bulbs
+    commands = [Bulb.SwitchOnCommand(), Bulb.SwitchOffCommand()]
+    recorded = 0
+    while recorded < events:
+        index = rng.randrange(bulbs)
+        if versions[index] == 0:
+            new_events = deciders[index].decide(Bulb.FitCommand(max_uses=events))
+        else:
+            new_events = deciders[index].decide(rng.choice(commands))
+        if new_events:
+            store.append_to_stream(f"bulb-{index}", versions[index], new_events)
+            versions[index] += len(new_events)
+            recorded += len(new_events)
+
+
+def replay(open_store) -> tuple[float, int]:
+    started = time.perf_counter()
+    store = open_store()
+    replayed = 0
+    for key in store.keys():
+        stream = store.load_stream(key)
+        fold(Bulb.evolve, Bulb.initial_state(), stream.events)
+        replayed += stream.version
+    elapsed = time.perf_counter() - started
+    if hasattr(store, "close"):
+        store.close()
+    return elapsed, replayed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bulbs", type=int, default=100)
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = os.path.join(directory, "events.log")
+        store = EventSourcingDecider.FileBasedEventStore(
+            log, bulb_event_serializer, bulb_event_deserializer, fsync=False
+        )
+        record(store, args.bulbs, args.events)
+
+        variants = {
+            "log": (
+                log,
+                lambda: EventSourcingDecider.FileBasedEventStore(
+                    log, bulb_event_serializer, bulb_event_deserializer, fsync=False
+                ),
+            )
+        }
+        compressions = ["none", "zlib"] + (["zstd"] if segments.zstandard else [])
+        for compression in compressions:
+            path = os.path.join(directory, f"{compression}.segment")
+            segments.seal(store, path, bulb_event_serializer, compression)
+            variants[f"segment/{compression}"] = (
+                path,
+                lambda path=path: segments.SegmentEventStore(
+                    path, bulb_event_deserializer
+                ),
+            )
+        store.close()
+
+        for name, (path, open_store) in variants.items():
+            elapsed, replayed = min(replay(open_store) for _ in range(args.repeat))
+            print(
+                f"{name:<16} {os.path.getsize(path) / replayed:>8.2f} bytes/event"
+                f" {replayed / elapsed:>12.0f} events/s replayed"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Time-to-first-command for a host registering hundreds of deciders.
+
+Generates a package of decider modules, then compares importing every module
+up front with registering them in a `DeciderRegistry` and loading lazily.
+Both variants import `infra`, so its own import time is reported separately.
+Each variant runs in a fresh interpreter so import caches do not leak.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+DECIDER_MODULE = textwrap.dedent(
+    """
+    import dataclasses
+    from typing import List
+
+    from interfaces import DeciderAggregate
+
+
+    class Toggle{index}(DeciderAggregate):
+        class Event(DeciderAggregate.Event):
+            pass
+
+        class Command(DeciderAggregate.Command):
+            pass
+
+        class State(DeciderAggregate.State):
+            pass
+
+        @classmethod
+        def initial_state(cls) -> "Toggle{index}.State":
+            return cls.OffState()
+
+        @classmethod
+        def is_terminal(cls, state: "Toggle{index}.State") -> bool:
+            return False
+
+        class ToggleCommand(Command):
+            def decide(self, state) -> List["Toggle{index}.Event"]:
+                return [Toggle{index}.ToggledEvent()]
+
+        @dataclasses.dataclass(frozen=True)
+        class ToggledEvent(Event):
+            pass
+
+        @dataclasses.dataclass(frozen=True)
+        class OffState(State):
+            def evolve(self, event) -> "Toggle{index}.State":
+                return Toggle{index}.OnState()
+
+        @dataclasses.dataclass(frozen=True)
+        class OnState(State):
+            def evolve(self, event) -> "Toggle{index}.State":
+                return Toggle{index}.OffState()
+    """
+)
+
+EAGER = textwrap.dedent(
+    """
+    import importlib, time
+    start = time.perf_counter()
+    aggregates = [
+        getattr(importlib.import_module(f"generated.toggle_{{i}}"), f"Toggle{{i}}")
+        for i in range({count})
+    ]
+    from infra import InMemoryDecider
+    InMemoryDecider(aggregates[0]).decide(aggregates[0].ToggleCommand())
+    print(time.perf_counter() - start)
+    """
+)
+
+INFRA = textwrap.dedent(
+    """
+    import time
+    start = time.perf_counter()
+    import infra
+    print(time.perf_counter() - start)
+    """
+)
+
+LAZY = textwrap.dedent(
+    """
+    import time
+    start = time.perf_counter()
+    from registry import DeciderRegistry
+    registry = DeciderRegistry()
+    for i in range({count}):
+        registry.register(f"Toggle{{i}}", f"generated.toggle_{{i}}:Toggle{{i}}")
+    from infra import InMemoryDecider
+    command = registry.command("Toggle0.ToggleCommand")
+    InMemoryDecider(registry.get("Toggle0")).decide(command)
+    print(time.perf_counter() - start)
+    """
+)
+
+
+def run(script: str, path: str) -> float:
+    env = {**os.environ, "PYTHONPATH": path}
+    # Measure imports from cached bytecode, as a deployed service would.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deciders", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    source = os.path.join(os.path.dirname(__file__), "..", "src")
+    with tempfile.TemporaryDirectory() as directory:
+        package = os.path.join(directory, "generated")
+        os.mkdir(package)
+        open(os.path.join(package, "__init__.py"), "w").close()
+        for index in range(args.deciders):
+            with open(os.path.join(package, f"toggle_{index}.py"), "w") as file:
+                file.write(DECIDER_MODULE.format(index=index))
+        path = os.pathsep.join([os.path.abspath(source), directory])
+
+        run(INFRA, path)  # Writes the bytecode cache.
+        timings = sorted(run(INFRA, path) for _ in range(args.repeat))
+        print(
+            f"infra: import time {timings[len(timings) // 2] * 1000:.1f} ms "
+            f"(median of {args.repeat})"
+        )
+        for name, script in (("eager", EAGER), ("lazy", LAZY)):
+            timings = sorted(
+                run(script.format(count=args.deciders), path)
+                for _ in range(args.repeat)
+            )
+            print(
+                f"{name:>5}: time to first command "
+                f"{timings[len(timings) // 2] * 1000:.1f} ms "
+                f"(median of {args.repeat}, {args.deciders} deciders)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import bisect
+import hashlib
+import multiprocessing
+import multiprocessing.connection
+import threading
+from typing import Callable, Type
+
+import interfaces
+from infra import EventSourcingDecider
+
+
+class ConsistentHashRing:
+    """Maps stream keys to workers, moving few keys when workers join."""
+
+    def __init__(self, replicas: int = 64) -> None:
+        self.replicas = replicas
+        self._hashes: list[int] = []
+        self._workers: list[int] = []
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def add(self, worker: int) -> None:
+        for replica in range(self.replicas):
+            point = self._hash(f"{worker}:{replica}")
+            index = bisect.bisect(self._hashes, point)
+            self._hashes.insert(index, point)
+            self._workers.insert(index, worker)
+
+    def worker_for(self, key: str) -> int:
+        if not self._hashes:
+            raise RuntimeError("No workers in the ring")
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._workers[index]
+
+
+def _serve(
+    connection: multiprocessing.connection.Connection,
+    aggregate: Type[interfaces.DeciderAggregate],
+    path: str,
+    serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+    deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+) -> None:
+    event_store = EventSourcingDecider.FileBasedEventStore(
+        path, serializer, deserializer
+    )
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                return
+            key, command = request
+            try:
+                events = EventSourcingDecider(aggregate, key, event_store).decide(
+                    command
+                )
+            except Exception as error:
+                connection.send((False, error))
+            else:
+                connection.send((True, events))
+    finally:
+        event_store.close()
+        connection.close()
+
+
+class ShardedCluster:
+    """Runs an aggregate in several worker processes sharing one event log.
+
+    Stream keys are partitioned over the workers with a consistent hash ring
+    and each `(key, command)` is routed to its owner over a pipe. Workers keep
+    no state between commands, so adding a worker only changes routing: the
+    keys it takes over are loaded from the shared `FileBasedEventStore`.
+    """
+
+    def __init__(
+        self,
+        aggregate: Type[interfaces.DeciderAggregate],
+        path: str,
+        serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+        deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+        workers: int = 2,
+        replicas: int = 64,
+    ) -> None:
+        self.aggregate = aggregate
+        self.path = path
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.ring = ConsistentHashRing(replicas)
+        self._processes: list[multiprocessing.Process] = []
+        self._connections: list[multiprocessing.connection.Connection] = []
+        self._locks: list[threading.Lock] = []
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            self.add_worker()
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.aggregate})"
+
+    @property
+    def workers(self) -> int:
+        return len(self._processes)
+
+    def add_worker(self) -> int:
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_serve,
+            args=(child, self.aggregate, self.path, self.serializer, self.deserializer),
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        with self._lock:
+            worker = len(self._processes)
+            self._processes.append(process)
+            self._connections.append(parent)
+            self._locks.append(threading.Lock())
+            self.ring.add(worker)
+        return worker
+
+    def decide(
+        self, key: str, command: interfaces.DeciderAggregate.Command
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        with self._lock:
+            worker = self.ring.worker_for(key)
+        with self._locks[worker]:
+            self._connections[worker].send((key, command))
+            succeeded, result = self._connections[worker].recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def state(self, key: str) -> interfaces.DeciderAggregate.State:
+        event_store = EventSourcingDecider.FileBasedEventStore(
+            self.path, self.serializer, self.deserializer
+        )
+        try:
+            return EventSourcingDecider(self.aggregate, key, event_store).state
+        finally:
+            event_store.close()
+
+    def close(self) -> None:
+        for lock, connection in zip(self._locks, self._connections):
+            with lock:
+                connection.send(None)
+                connection.close()
+        for process in self._processes:
+            process.join()
@@ -1,11 +1,29 @@
 from typing import List, TypeAlias, Union
 
 import interfaces
+import profiling
+
+# Composed deciders keyed by the identity of their components. The cached
+# decider keeps both components alive, so their ids cannot be reused.
+_composed_deciders: dict[tuple[int, int], interfaces.DeciderAggregate] = {}
 
 
 def compose_decider_aggregates(
     decider_x: interfaces.DeciderAggregate,
     decider_y: interfaces.DeciderAggregate,
+) -> interfaces.DeciderAggregate:
+    key = (id(decider_x), id(decider_y))
+    composed = _composed_deciders.get(key)
+    if composed is None:
+        composed = _composed_deciders.setdefault(
+            key, _build_composed_decider(decider_x, decider_y)
+        )
+    return composed
+
+
+def _build_composed_decider(
+    decider_x: interfaces.DeciderAggregate,
+    decider_y: interfaces.DeciderAggregate,
 ) -> interfaces.DeciderAggregate:
     class ComposedDecider(interfaces.DeciderAggregate):
 
@@ -16,6 +34,10 @@ def compose_decider_aggregates(
         EventY: TypeAlias = decider_y.Event
         StateY: TypeAlias = decider_y.State
 
+        profile_name = (
+            f"ComposedDecider({profiling.name(decider_x)},{profiling.name(decider_y)})"
+        )
+
         class CombinedState(interfaces.DeciderAggregate.State):
             def __init__(
                 self,
@@ -34,15 +56,35 @@ def compose_decider_aggregates(
             def __repr__(self) -> str:
                 return str(self)
 
+            @property
+            def absorbing(self) -> bool:
+                return self.decider_x_state.absorbing and self.decider_y_state.absorbing
+
             def evolve(
                 self, event: Union["ComposedDecider.EventX", "ComposedDecider.EventY"]
-            ) -> Union["ComposedDecider.StateX", "ComposedDecider.StateY"]:
+            ) -> "ComposedDecider.CombinedState":
+                # Only the side the event belongs to changes; the other side is
+                # reused, and so is `self` when that side did not change either.
                 if isinstance(event, ComposedDecider.EventX):
-                    state_x = decider_x.initial_state()
-                    return state_x.evolve(event)
+                    x_state = self.decider_x_state
+                    if x_state.absorbing:
+                        return self
+                    new_x_state = decider_x.evolve(x_state, event)
+                    if new_x_state is x_state:
+                        return self
+                    return ComposedDecider.CombinedState(
+                        new_x_state, self.decider_y_state
+                    )
                 elif isinstance(event, ComposedDecider.EventY):
-                    state_y = decider_y.initial_state()
-                    return state_y.evolve(event)
+                    y_state = self.decider_y_state
+                    if y_state.absorbing:
+                        return self
+                    new_y_state = decider_y.evolve(y_state, event)
+                    if new_y_state is y_state:
+                        return self
+                    return ComposedDecider.CombinedState(
+                        self.decider_x_state, new_y_state
+                    )
                 raise ValueError(f"Invalid event {event}")
 
         def __str__(self) -> str:
@@ -51,6 +93,7 @@ def compose_decider_aggregates(
         def __repr__(self) -> str:
             return str(self)
 
+        @profiling.profiled("decide", 0)
         @classmethod
         def decide(
             cls,
@@ -78,24 +121,19 @@ def compose_decider_aggregates(
                 return decider_y.decide(command, y_state)
             raise ValueError(f"Invalid command {command} or state {state}")
 
+        @profiling.profiled("evolve", 1)
         @classmethod
         def evolve(
             cls,
             state: StateX | StateY | CombinedState,
             event: EventX | EventY,
         ) -> StateX | StateY | CombinedState:
+            if isinstance(state, ComposedDecider.CombinedState):
+                return state.evolve(event)
             if isinstance(event, ComposedDecider.EventX):
-                if isinstance(state, ComposedDecider.CombinedState):
-                    x_state = decider_x.evolve(state.decider_x_state, event)
-                    return ComposedDecider.CombinedState(x_state, state.decider_y_state)
-                else:
-                    return decider_x.evolve(state, event)
+                return decider_x.evolve(state, event)
             elif isinstance(event, ComposedDecider.EventY):
-                if isinstance(state, ComposedDecider.CombinedState):
-                    y_state = decider_y.evolve(state.decider_y_state, event)
-                    return ComposedDecider.CombinedState(state.decider_x_state, y_state)
-                else:
-                    return decider_y.evolve(state, event)
+                return decider_y.evolve(state, event)
             raise ValueError(f"Invalid event {event} or state {state}")
 
         @classmethod
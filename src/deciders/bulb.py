@@ -90,5 +90,7 @@ class Bulb(DeciderAggregate):
             raise Exception(f"Unknown event `{event}`")
 
     class BlownState(State):
+        absorbing = True
+
         def evolve(self, _: "Bulb.Event") -> "Bulb.State":
             return self
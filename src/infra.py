@@ -1,8 +1,29 @@
+import bisect
+import collections
+import contextlib
 import dataclasses
+import fcntl
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
 import uuid
-from typing import Callable, Type
+from typing import TYPE_CHECKING, Callable, Iterator, Type
 
 import interfaces
+import profiling
+
+# Imported where used: these modules cost more to import than the rest of
+# `infra` together, and most processes only need one of the stores.
+if TYPE_CHECKING:
+    import concurrent.futures
+    import sqlite3
 
 
 def fold(
@@ -12,9 +33,26 @@ def fold(
     ],
     initial_state: interfaces.DeciderAggregate.State,
     events: list[interfaces.DeciderAggregate.Event],
+) -> interfaces.DeciderAggregate.State:
+    profiler = profiling.ACTIVE
+    if profiler is None:
+        return _fold(evolve_function, initial_state, events)
+    with profiler.measure("fold"):
+        return _fold(profiler.wrap_evolve(evolve_function), initial_state, events)
+
+
+def _fold(
+    evolve_function: Callable[
+        [interfaces.DeciderAggregate.State, interfaces.DeciderAggregate.Event],
+        interfaces.DeciderAggregate.State,
+    ],
+    initial_state: interfaces.DeciderAggregate.State,
+    events: list[interfaces.DeciderAggregate.Event],
 ) -> interfaces.DeciderAggregate.State:
     state = initial_state
     for event in events:
+        if state.absorbing:
+            break
         state = evolve_function(state, event)
     return state
 
@@ -28,66 +66,393 @@ class InMemoryDecider(interfaces.Decider):
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self.aggregate})"
 
+    @profiling.profiled("decide", 0)
     def decide(
         self, command: interfaces.DeciderAggregate.Command
     ) -> list[interfaces.DeciderAggregate.Event]:
+        if self.state.absorbing:
+            return []
         events = self.aggregate.decide(command, self.state)
         self.state = fold(self.aggregate.evolve, self.state, events)
         return events
 
 
+def footprint(state: interfaces.DeciderAggregate.State) -> int:
+    """Approximate number of bytes held by a state and its attributes."""
+    size = sys.getsizeof(state)
+    for value in getattr(state, "__dict__", {}).values():
+        if isinstance(value, interfaces.DeciderAggregate.State):
+            size += footprint(value)
+        else:
+            size += sys.getsizeof(value)
+    return size
+
+
+class InMemoryDeciderFleet:
+    """Hosts many in-memory deciders within a memory budget.
+
+    Resident deciders are kept in least-recently-used order together with the
+    footprint of their state. When the total exceeds `memory_budget` bytes,
+    the coldest deciders are serialized to a spill file and dropped; the next
+    command for such a key reloads its state from there.
+    """
+
+    @dataclasses.dataclass
+    class Stats:
+        hits: int = 0
+        misses: int = 0
+        evictions: int = 0
+
+    def __init__(
+        self,
+        aggregate: Type[interfaces.DeciderAggregate],
+        serializer: Callable[[interfaces.DeciderAggregate.State], str],
+        deserializer: Callable[[str], interfaces.DeciderAggregate.State],
+        spill_path: str,
+        memory_budget: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.aggregate = aggregate
+        self.serializer = serializer
+        self.deserializer = deserializer
+        self.memory_budget = memory_budget
+        self.memory = 0
+        self.stats = InMemoryDeciderFleet.Stats()
+        import dbm
+
+        self._spill = dbm.open(spill_path, "c")
+        self._deciders: collections.OrderedDict[str, InMemoryDecider] = (
+            collections.OrderedDict()
+        )
+        self._footprints: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.aggregate})"
+
+    def __len__(self) -> int:
+        return len(self._deciders)
+
+    def close(self) -> None:
+        self._spill.close()
+
+    def decide(
+        self, key: str, command: interfaces.DeciderAggregate.Command
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        with self._lock:
+            decider = self.__load(key)
+            events = decider.decide(command)
+            if events:
+                self.__track(key, footprint(decider.state))
+                self.__evict()
+            return events
+
+    def state(self, key: str) -> interfaces.DeciderAggregate.State:
+        """Current state of a key; reading it does not make the key resident."""
+        with self._lock:
+            decider = self._deciders.get(key)
+            if decider is not None:
+                self.stats.hits += 1
+                self._deciders.move_to_end(key)
+                return decider.state
+            self.stats.misses += 1
+            spilled = self._spill.get(key)
+            if spilled is None:
+                return self.aggregate.initial_state()
+            return self.deserializer(spilled.decode("utf-8"))
+
+    def is_resident(self, key: str) -> bool:
+        return key in self._deciders
+
+    def __load(self, key: str) -> InMemoryDecider:
+        decider = self._deciders.get(key)
+        if decider is not None:
+            self.stats.hits += 1
+            self._deciders.move_to_end(key)
+            return decider
+        # Cold keys count as misses too: they are not resident either.
+        self.stats.misses += 1
+        decider = InMemoryDecider(self.aggregate)
+        spilled = self._spill.get(key)
+        if spilled is not None:
+            decider.state = self.deserializer(spilled.decode("utf-8"))
+            del self._spill[key]
+        self._deciders[key] = decider
+        self.__track(key, footprint(decider.state))
+        self.__evict()
+        return decider
+
+    def __track(self, key: str, size: int) -> None:
+        self.memory += size - self._footprints.get(key, 0)
+        self._footprints[key] = size
+
+    def __evict(self) -> None:
+        # The most recently used decider always stays resident.
+        while self.memory > self.memory_budget and len(self._deciders) > 1:
+            key, decider = self._deciders.popitem(last=False)
+            self._spill[key] = self.serializer(decider.state).encode("utf-8")
+            self.memory -= self._footprints.pop(key)
+            self.stats.evictions += 1
+
+
 class StateBasedDecider(interfaces.Decider):
     @dataclasses.dataclass(frozen=True)
     class StoredValue:
         state: str
         etag: uuid.UUID
 
+    class DictBasedStateStore(interfaces.StateStore):
+        def __init__(
+            self, container: dict[str, "StateBasedDecider.StoredValue"] | None = None
+        ) -> None:
+            self.container = {} if container is None else container
+            self._lock = threading.Lock()
+
+        def load(self, key: str) -> "StateBasedDecider.StoredValue | None":
+            return self.container.get(key)
+
+        def compare_and_swap(
+            self, key: str, expected_etag: uuid.UUID | None, state: str
+        ) -> "StateBasedDecider.StoredValue":
+            with self._lock:
+                current = self.container.get(key)
+                current_etag = None if current is None else current.etag
+                if current_etag != expected_etag:
+                    raise ValueError("ETag mismatch")
+                stored_value = StateBasedDecider.StoredValue(state, uuid.uuid4())
+                self.container[key] = stored_value
+                return stored_value
+
+    class SQLiteStateStore(interfaces.StateStore):
+        """State store backed by an SQLite table.
+
+        Connections are pooled and reused; the statements below are compiled
+        once per connection and served from sqlite3's statement cache.
+        """
+
+        CREATE_TABLE = (
+            "CREATE TABLE IF NOT EXISTS states"
+            " (key TEXT PRIMARY KEY, state TEXT NOT NULL, etag TEXT NOT NULL)"
+        )
+        SELECT = "SELECT state, etag FROM states WHERE key = ?"
+        INSERT = "INSERT OR IGNORE INTO states (key, state, etag) VALUES (?, ?, ?)"
+        UPDATE = "UPDATE states SET state = ?, etag = ? WHERE key = ? AND etag = ?"
+
+        def __init__(self, path: str, pool_size: int = 4) -> None:
+            import sqlite3
+
+            self.path = path
+            self._pool: queue.Queue[sqlite3.Connection] = queue.Queue()
+            for _ in range(pool_size):
+                connection = sqlite3.connect(
+                    path, timeout=30, check_same_thread=False, isolation_level=None
+                )
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(self.CREATE_TABLE)
+                self._pool.put(connection)
+            self.pool_size = pool_size
+
+        def close(self) -> None:
+            for _ in range(self.pool_size):
+                self._pool.get().close()
+
+        @contextlib.contextmanager
+        def _connection(self) -> Iterator["sqlite3.Connection"]:
+            connection = self._pool.get()
+            try:
+                yield connection
+            finally:
+                self._pool.put(connection)
+
+        def load(self, key: str) -> "StateBasedDecider.StoredValue | None":
+            with self._connection() as connection:
+                row = connection.execute(self.SELECT, (key,)).fetchone()
+            if row is None:
+                return None
+            return StateBasedDecider.StoredValue(row[0], uuid.UUID(row[1]))
+
+        def compare_and_swap(
+            self, key: str, expected_etag: uuid.UUID | None, state: str
+        ) -> "StateBasedDecider.StoredValue":
+            etag = uuid.uuid4()
+            with self._connection() as connection:
+                if expected_etag is None:
+                    cursor = connection.execute(self.INSERT, (key, state, str(etag)))
+                else:
+                    cursor = connection.execute(
+                        self.UPDATE, (state, str(etag), key, str(expected_etag))
+                    )
+            if cursor.rowcount != 1:
+                raise ValueError("ETag mismatch")
+            return StateBasedDecider.StoredValue(state, etag)
+
+    class FileBasedStateStore(interfaces.StateStore):
+        """One `<quoted key>.state` file per key holding the etag on its first line.
+
+        Swaps happen under an exclusive `flock` on the directory's lock file and
+        atomically replace the state file with a fully written and synced
+        temporary file, so several processes may share the directory and a
+        crash never leaves a partial state behind.
+        """
+
+        def __init__(self, directory: str) -> None:
+            self.directory = directory
+            os.makedirs(directory, exist_ok=True)
+            self._lock_fd = os.open(
+                os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644
+            )
+            self._lock = threading.Lock()
+
+        def close(self) -> None:
+            os.close(self._lock_fd)
+
+        def _path(self, key: str) -> str:
+            # The suffix keeps keys apart from the lock and temporary files.
+            quoted = urllib.parse.quote(key, safe="")
+            return os.path.join(self.directory, f"{quoted}.state")
+
+        def load(self, key: str) -> "StateBasedDecider.StoredValue | None":
+            try:
+                with open(self._path(key), encoding="utf-8") as file:
+                    etag, _, state = file.read().partition("\n")
+            except FileNotFoundError:
+                return None
+            return StateBasedDecider.StoredValue(state, uuid.UUID(etag))
+
+        def compare_and_swap(
+            self, key: str, expected_etag: uuid.UUID | None, state: str
+        ) -> "StateBasedDecider.StoredValue":
+            with self._lock:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                try:
+                    current = self.load(key)
+                    current_etag = None if current is None else current.etag
+                    if current_etag != expected_etag:
+                        raise ValueError("ETag mismatch")
+                    stored_value = StateBasedDecider.StoredValue(state, uuid.uuid4())
+                    fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                    try:
+                        with open(fd, "w", encoding="utf-8") as file:
+                            file.write(f"{stored_value.etag}\n{state}")
+                            file.flush()
+                            os.fsync(file.fileno())
+                        os.replace(temporary, self._path(key))
+                    except BaseException:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(temporary)
+                        raise
+                    return stored_value
+                finally:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    class StateCache:
+        """Bounded LRU of deserialized states, validated by etag.
+
+        States are immutable, so as long as the stored etag is unchanged the
+        runner can reuse the live state object instead of deserializing it.
+        """
+
+        def __init__(self, max_size: int = 1024) -> None:
+            self.max_size = max_size
+            self._entries: collections.OrderedDict[
+                str, tuple[uuid.UUID, interfaces.DeciderAggregate.State]
+            ] = collections.OrderedDict()
+            self._lock = threading.Lock()
+
+        def get(
+            self, key: str, etag: uuid.UUID
+        ) -> interfaces.DeciderAggregate.State | None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != etag:
+                    return None
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        def put(
+            self, key: str, etag: uuid.UUID, state: interfaces.DeciderAggregate.State
+        ) -> None:
+            with self._lock:
+                self._entries[key] = (etag, state)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
     def __init__(
         self,
         aggregate: Type[interfaces.DeciderAggregate],
         serializer: Callable[[interfaces.DeciderAggregate.State], str],
         deserializer: Callable[[str], interfaces.DeciderAggregate.State],
-        container: dict[str, StoredValue],
+        container: dict[str, StoredValue] | interfaces.StateStore,
         key: str,
+        cache: "StateBasedDecider.StateCache | None" = None,
     ) -> None:
         self.aggregate = aggregate
-        self.container: dict[str, StateBasedDecider.StoredValue] = container
+        self.container = container
+        if isinstance(container, interfaces.StateStore):
+            self.state_store = container
+        else:
+            self.state_store = StateBasedDecider.DictBasedStateStore(container)
         self.serializer = serializer
         self.deserializer = deserializer
         self.key = key
+        self.cache = StateBasedDecider.StateCache() if cache is None else cache
+        # Once the stored state is absorbing no writer can change it anymore.
+        self._absorbing_state: interfaces.DeciderAggregate.State | None = None
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self.aggregate})"
 
+    @profiling.profiled("decide", 0)
     def decide(
         self, command: interfaces.DeciderAggregate.Command
     ) -> list[interfaces.DeciderAggregate.Event]:
-        stored_value: StateBasedDecider.StoredValue | None = self.container.get(
-            self.key
-        )
+        if self._absorbing_state is not None:
+            return []
+        stored_value = self.state_store.load(self.key)
         if stored_value is None:
             state = self.aggregate.initial_state()
-            etag = uuid.uuid4()
+            etag = None
         else:
-            state = self.deserializer(stored_value.state)
+            state = self.__deserialize(stored_value)
             etag = stored_value.etag
+        if state.absorbing:
+            self._absorbing_state = state
+            return []
         events = self.aggregate.decide(command, state)
+        if not events:
+            # Nothing changed, so there is nothing to write back.
+            return events
         state = fold(self.aggregate.evolve, state, events)
         self.__store(state, etag)
+        if state.absorbing:
+            self._absorbing_state = state
         return events
 
     @property
     def state(self) -> interfaces.DeciderAggregate.State:
-        return self.deserializer(self.container[self.key].state)
+        if self._absorbing_state is not None:
+            return self._absorbing_state
+        stored_value = self.state_store.load(self.key)
+        if stored_value is None:
+            return self.aggregate.initial_state()
+        return self.__deserialize(stored_value)
+
+    def __deserialize(
+        self, stored_value: "StateBasedDecider.StoredValue"
+    ) -> interfaces.DeciderAggregate.State:
+        state = self.cache.get(self.key, stored_value.etag)
+        if state is None:
+            state = self.deserializer(stored_value.state)
+            self.cache.put(self.key, stored_value.etag, state)
+        return state
 
     def __store(
-        self, state: interfaces.DeciderAggregate.State, etag: uuid.UUID
+        self, state: interfaces.DeciderAggregate.State, etag: uuid.UUID | None
     ) -> None:
-        if self.key in self.container and self.container[self.key].etag != etag:
-            raise ValueError("ETag mismatch")
-        self.container[self.key] = StateBasedDecider.StoredValue(
-            state=self.serializer(state), etag=etag
+        stored_value = self.state_store.compare_and_swap(
+            self.key, etag, self.serializer(state)
         )
+        self.cache.put(self.key, stored_value.etag, state)
 
 
 class EventSourcingDecider(interfaces.Decider):
@@ -97,10 +462,115 @@ class EventSourcingDecider(interfaces.Decider):
             default_factory=list
         )
         version: int = 0
+        timestamps: list[float] = dataclasses.field(default_factory=list)
+
+    @dataclasses.dataclass(frozen=True)
+    class RecordedEvent:
+        key: str
+        event: interfaces.DeciderAggregate.Event
+        timestamp: float
+        position: int
+
+    @dataclasses.dataclass(frozen=True)
+    class Snapshot:
+        version: int
+        state: str
 
-    class DictBasedEventStore:
+    class DictBasedSnapshotStore(interfaces.SnapshotStore):
         def __init__(self) -> None:
+            self.storage: dict[str, dict[int, str]] = {}
+            # Sorted versions of each key's snapshots.
+            self._versions: dict[str, list[int]] = {}
+
+        def save(self, key: str, version: int, state: str) -> None:
+            snapshots = self.storage.setdefault(key, {})
+            if version not in snapshots:
+                bisect.insort(self._versions.setdefault(key, []), version)
+            snapshots[version] = state
+
+        def load(
+            self, key: str, max_version: int | None = None
+        ) -> "EventSourcingDecider.Snapshot | None":
+            versions = self._versions.get(key)
+            if not versions:
+                return None
+            if max_version is None:
+                index = len(versions)
+            else:
+                index = bisect.bisect_right(versions, max_version)
+            if index == 0:
+                return None
+            version = versions[index - 1]
+            return EventSourcingDecider.Snapshot(version, self.storage[key][version])
+
+    class SQLiteSnapshotStore(interfaces.SnapshotStore):
+        CREATE_TABLE = (
+            "CREATE TABLE IF NOT EXISTS snapshots (key TEXT NOT NULL,"
+            " version INTEGER NOT NULL, state TEXT NOT NULL,"
+            " PRIMARY KEY (key, version))"
+        )
+        INSERT = (
+            "INSERT OR REPLACE INTO snapshots (key, version, state) VALUES (?, ?, ?)"
+        )
+        SELECT = (
+            "SELECT version, state FROM snapshots WHERE key = ? AND version <= ?"
+            " ORDER BY version DESC LIMIT 1"
+        )
+
+        def __init__(self, path: str) -> None:
+            import sqlite3
+
+            self.path = path
+            self._connection = sqlite3.connect(
+                path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(self.CREATE_TABLE)
+            self._lock = threading.Lock()
+
+        def close(self) -> None:
+            self._connection.close()
+
+        def save(self, key: str, version: int, state: str) -> None:
+            with self._lock:
+                self._connection.execute(self.INSERT, (key, version, state))
+
+        def save_many(self, snapshots: list[tuple[str, int, str]]) -> None:
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("BEGIN")
+                    self._connection.executemany(self.INSERT, snapshots)
+
+        def load(
+            self, key: str, max_version: int | None = None
+        ) -> "EventSourcingDecider.Snapshot | None":
+            if max_version is None:
+                max_version = sys.maxsize
+            with self._lock:
+                row = self._connection.execute(
+                    self.SELECT, (key, max_version)
+                ).fetchone()
+            if row is None:
+                return None
+            return EventSourcingDecider.Snapshot(row[0], row[1])
+
+    class DictBasedEventStore(interfaces.EventStore):
+        """Streams kept in a dict, plus an opt-in log of the events to deliver.
+
+        With `outbox=True` every append is also added to a log read by
+        `read_all`. The log only holds events that have not been trimmed yet:
+        readers of `read_all` call `trim` once they delivered up to a
+        position, so it does not grow with the whole history. Without
+        `outbox` nothing is logged and `read_all` raises.
+        """
+
+        def __init__(self, outbox: bool = False) -> None:
             self.storage: dict[str, "EventSourcingDecider.EventsStream"] = {}
+            self.outbox = outbox
+            self.log: list[tuple[str, interfaces.DeciderAggregate.Event, float]] = []
+            self.clock: Callable[[], float] = time.time
+            # Position of the first event left in `log`.
+            self._log_start = 0
 
         def load_stream(self, key: str) -> "EventSourcingDecider.EventsStream":
             if key not in self.storage:
@@ -113,28 +583,385 @@ class EventSourcingDecider(interfaces.Decider):
             expected_version: int,
             events: list[interfaces.DeciderAggregate.Event],
         ) -> None:
+            timestamp = self.clock()
             if expected_version > 0:
                 current_stream = self.storage[key]
                 if current_stream.version != expected_version:
                     raise RuntimeError("Concurrent stream write")
                 current_stream.version += len(events)
                 current_stream.events.extend(events)
+                current_stream.timestamps.extend([timestamp] * len(events))
                 self.storage[key] = current_stream
             else:
-                stream = EventSourcingDecider.EventsStream(events, len(events))
+                # Copy, so later appends don't grow the list returned to the caller.
+                stream = EventSourcingDecider.EventsStream(
+                    list(events), len(events), [timestamp] * len(events)
+                )
                 self.storage[key] = stream
+            if self.outbox:
+                self.log.extend((key, event, timestamp) for event in events)
+
+        def keys(self) -> list[str]:
+            return list(self.storage)
+
+        def read_all(
+            self, position: int, limit: int
+        ) -> list["EventSourcingDecider.RecordedEvent"]:
+            if not self.outbox:
+                raise RuntimeError("The store keeps no log; create it with outbox=True")
+            position = max(position, self._log_start)
+            start = position - self._log_start
+            return [
+                EventSourcingDecider.RecordedEvent(key, event, timestamp, index + 1)
+                for index, (key, event, timestamp) in enumerate(
+                    self.log[start : start + limit], start=position
+                )
+            ]
+
+        def trim(self, position: int) -> None:
+            """Forgets the log entries before `position`; streams are kept."""
+            if position > self._log_start:
+                del self.log[: position - self._log_start]
+                self._log_start = position
+
+    class FileBasedEventStore(interfaces.EventStore):
+        """Append-only event log read back through a memory map.
+
+        Each record is a `<key length, payload length, append time>` header
+        followed by the key and the serialized event. A per-stream index of
+        payload offsets and append times is built by scanning the log, so
+        loading a stream decodes events straight out of `memoryview` slices of
+        the map, and time lookups bisect the index without decoding anything.
+        Appends take an exclusive `flock`, which lets several processes share
+        the same log file.
+        """
+
+        HEADER = struct.Struct("<HId")
+
+        def __init__(
+            self,
+            path: str,
+            serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+            deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+            fsync: bool = True,
+        ) -> None:
+            self.path = path
+            self.serializer = serializer
+            self.deserializer = deserializer
+            self.fsync = fsync
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            self._map: mmap.mmap | None = None
+            self._scanned = 0
+            self._offsets: dict[str, list[tuple[int, int]]] = {}
+            self._timestamps: dict[str, list[float]] = {}
+            self.clock: Callable[[], float] = time.time
+            self._lock = threading.Lock()
+
+        def close(self) -> None:
+            with self._lock:
+                if self._map is not None:
+                    self._map.close()
+                    self._map = None
+                os.close(self._fd)
+
+        def keys(self) -> list[str]:
+            with self._lock:
+                self._refresh()
+                return list(self._offsets)
 
-    def __init__(self, aggregate: interfaces.DeciderAggregate, key: str) -> None:
-        self.event_store = EventSourcingDecider.DictBasedEventStore()
+        def load_stream(self, key: str) -> "EventSourcingDecider.EventsStream":
+            with self._lock:
+                self._refresh()
+                offsets = self._offsets.get(key)
+                if not offsets:
+                    return EventSourcingDecider.EventsStream()
+                events = self._decode(offsets)
+                return EventSourcingDecider.EventsStream(
+                    events, len(events), list(self._timestamps[key])
+                )
+
+        def load_events(
+            self, key: str, start: int, stop: int
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            with self._lock:
+                self._refresh()
+                return self._decode(self._offsets.get(key, [])[start:stop])
+
+        def version_at(self, key: str, timestamp: float) -> int:
+            with self._lock:
+                self._refresh()
+                return bisect.bisect_right(self._timestamps.get(key, []), timestamp)
+
+        def read_all(
+            self, position: int, limit: int
+        ) -> list["EventSourcingDecider.RecordedEvent"]:
+            """Reads records after the byte offset `position` of the log."""
+            recorded = []
+            with self._lock:
+                self._refresh()
+                while position < self._scanned and len(recorded) < limit:
+                    key, start, end, timestamp = self._read_record(position)
+                    event = self.deserializer(str(self._map[start:end], "utf-8"))
+                    recorded.append(
+                        EventSourcingDecider.RecordedEvent(key, event, timestamp, end)
+                    )
+                    position = end
+            return recorded
+
+        def _decode(
+            self, offsets: list[tuple[int, int]]
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            if not offsets:
+                return []
+            with memoryview(self._map) as view:
+                return [
+                    self.deserializer(str(view[start:end], "utf-8"))
+                    for start, end in offsets
+                ]
+
+        def append_to_stream(
+            self,
+            key: str,
+            expected_version: int,
+            events: list[interfaces.DeciderAggregate.Event],
+        ) -> None:
+            [error] = self.append_batch([(key, expected_version, events)])
+            if error is not None:
+                raise error
+
+        def append_batch(
+            self,
+            appends: list[tuple[str, int, list[interfaces.DeciderAggregate.Event]]],
+        ) -> list[Exception | None]:
+            """Write several appends with a single write and fsync.
+
+            Every append is checked against its stream version, counting the
+            appends accepted earlier in the same batch. Only the conflicting
+            appends fail; their errors are returned in the matching position.
+            """
+            errors: list[Exception | None] = []
+            with self._lock:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    if os.fstat(self._fd).st_size > self._scanned:
+                        # Writers hold the lock while writing, so a record left
+                        # incomplete under it is the remains of a crashed write.
+                        os.ftruncate(self._fd, self._scanned)
+                    versions: dict[str, int] = {}
+                    buffer = bytearray()
+                    timestamp = self.clock()
+                    for key, expected_version, events in appends:
+                        version = versions.get(key, len(self._offsets.get(key, ())))
+                        if version != expected_version:
+                            errors.append(RuntimeError("Concurrent stream write"))
+                            continue
+                        try:
+                            buffer += self._encode(key, events, timestamp)
+                        except Exception as error:
+                            errors.append(error)
+                            continue
+                        versions[key] = version + len(events)
+                        errors.append(None)
+                    if buffer:
+                        self._write(bytes(buffer))
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            return errors
+
+        def _encode(
+            self,
+            key: str,
+            events: list[interfaces.DeciderAggregate.Event],
+            timestamp: float,
+        ) -> bytes:
+            key_bytes = key.encode("utf-8")
+            buffer = bytearray()
+            for event in events:
+                payload = self.serializer(event).encode("utf-8")
+                buffer += self.HEADER.pack(len(key_bytes), len(payload), timestamp)
+                buffer += key_bytes
+                buffer += payload
+            return bytes(buffer)
+
+        def _write(self, data: bytes) -> None:
+            os.write(self._fd, data)
+            if self.fsync:
+                os.fsync(self._fd)
+
+        def _refresh(self) -> None:
+            size = os.fstat(self._fd).st_size
+            if size <= self._scanned:
+                return
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+            position = self._scanned
+            while position + self.HEADER.size <= size:
+                key_length, payload_length, _ = self.HEADER.unpack_from(
+                    self._map, position
+                )
+                if position + self.HEADER.size + key_length + payload_length > size:
+                    # Another process is still writing this record.
+                    break
+                key, start, end, timestamp = self._read_record(position)
+                self._offsets.setdefault(key, []).append((start, end))
+                self._timestamps.setdefault(key, []).append(timestamp)
+                position = end
+            self._scanned = position
+
+        def _read_record(self, position: int) -> tuple[str, int, int, float]:
+            key_length, payload_length, timestamp = self.HEADER.unpack_from(
+                self._map, position
+            )
+            key_start = position + self.HEADER.size
+            start = key_start + key_length
+            key = str(self._map[key_start:start], "utf-8")
+            return key, start, start + payload_length, timestamp
+
+    class GroupCommitEventStore(interfaces.EventStore):
+        """Coalesces concurrent appends into batched writes.
+
+        Callers block in `append_to_stream` while a writer thread collects the
+        appends arriving within `max_latency` seconds (up to `max_batch` of
+        them) and hands them to the wrapped store's `append_batch`, so one
+        write and one fsync cover the whole group.
+        """
+
+        def __init__(
+            self,
+            event_store: "EventSourcingDecider.FileBasedEventStore",
+            max_latency: float = 0.002,
+            max_batch: int = 256,
+        ) -> None:
+            self.event_store = event_store
+            self.max_latency = max_latency
+            self.max_batch = max_batch
+            import concurrent.futures
+
+            self._future = concurrent.futures.Future
+            self._pending: queue.Queue = queue.Queue()
+            self._closed = False
+            self._closing = threading.Lock()
+            self._writer = threading.Thread(target=self._run, daemon=True)
+            self._writer.start()
+
+        def close(self) -> None:
+            with self._closing:
+                if self._closed:
+                    return
+                self._closed = True
+                self._pending.put(None)
+            self._writer.join()
+
+        def load_stream(self, key: str) -> "EventSourcingDecider.EventsStream":
+            return self.event_store.load_stream(key)
+
+        def keys(self) -> list[str]:
+            return self.event_store.keys()
+
+        def load_events(
+            self, key: str, start: int, stop: int
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            return self.event_store.load_events(key, start, stop)
+
+        def version_at(self, key: str, timestamp: float) -> int:
+            return self.event_store.version_at(key, timestamp)
+
+        def read_all(
+            self, position: int, limit: int
+        ) -> list["EventSourcingDecider.RecordedEvent"]:
+            return self.event_store.read_all(position, limit)
+
+        def append_to_stream(
+            self,
+            key: str,
+            expected_version: int,
+            events: list[interfaces.DeciderAggregate.Event],
+        ) -> None:
+            result: concurrent.futures.Future = self._future()
+            with self._closing:
+                if self._closed:
+                    raise RuntimeError("Group commit store is closed")
+                self._pending.put((key, expected_version, events, result))
+            result.result()
+
+        def _run(self) -> None:
+            while True:
+                first = self._pending.get()
+                if first is None:
+                    return
+                batch = [first]
+                stopping = False
+                deadline = time.monotonic() + self.max_latency
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._pending.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit(batch)
+                if stopping:
+                    return
+
+        def _commit(self, batch: list[tuple]) -> None:
+            try:
+                errors = self.event_store.append_batch(
+                    [(key, version, events) for key, version, events, _ in batch]
+                )
+            except Exception as error:
+                errors = [error] * len(batch)
+            for (_, _, _, result), error in zip(batch, errors):
+                if error is None:
+                    result.set_result(None)
+                else:
+                    result.set_exception(error)
+
+    def __init__(
+        self,
+        aggregate: interfaces.DeciderAggregate,
+        key: str,
+        event_store: interfaces.EventStore | None = None,
+        snapshot_store: interfaces.SnapshotStore | None = None,
+        state_serializer: Callable[[interfaces.DeciderAggregate.State], str]
+        | None = None,
+        state_deserializer: Callable[[str], interfaces.DeciderAggregate.State]
+        | None = None,
+        snapshot_interval: int = 100,
+    ) -> None:
+        if snapshot_store is not None and (
+            state_serializer is None or state_deserializer is None
+        ):
+            raise ValueError(
+                "A snapshot store needs a state serializer and deserializer"
+            )
+        if event_store is None:
+            event_store = EventSourcingDecider.DictBasedEventStore()
+        self.event_store = event_store
         self.key = key
         self.aggregate = aggregate
+        self.snapshot_store = snapshot_store
+        self.state_serializer = state_serializer
+        self.state_deserializer = state_deserializer
+        self.snapshot_interval = snapshot_interval
+        # Once the stream reaches an absorbing state no append can change it.
+        self._absorbing_state: interfaces.DeciderAggregate.State | None = None
 
     def __str__(self) -> str:
         return f"{self.__class__.__name__}({self.aggregate})"
 
+    @profiling.profiled("decide", 0)
     def decide(
         self, command: interfaces.DeciderAggregate.Command
     ) -> list[interfaces.DeciderAggregate.Event]:
+        if self._absorbing_state is not None:
+            return []
         event_stream = self.event_store.load_stream(self.key)
         if event_stream.version == 0:
             state = self.aggregate.initial_state()
@@ -144,14 +971,356 @@ class EventSourcingDecider(interfaces.Decider):
                 self.aggregate.initial_state(),
                 event_stream.events,
             )
+        if state.absorbing:
+            self._absorbing_state = state
+            return []
+        version = event_stream.version
         events = self.aggregate.decide(command, state)
-        self.event_store.append_to_stream(self.key, event_stream.version, events)
+        if not events:
+            return events
+        self.event_store.append_to_stream(self.key, version, events)
+        state = fold(self.aggregate.evolve, state, events)
+        self.__snapshot(state, version, version + len(events))
+        if state.absorbing:
+            self._absorbing_state = state
         return events
 
     @property
     def state(self) -> interfaces.DeciderAggregate.State:
+        if self._absorbing_state is not None:
+            return self._absorbing_state
         event_stream = self.event_store.load_stream(self.key)
         state = fold(
             self.aggregate.evolve, self.aggregate.initial_state(), event_stream.events
         )
         return state
+
+    def state_at(
+        self, version: int | None = None, timestamp: float | None = None
+    ) -> interfaces.DeciderAggregate.State:
+        """State of the stream at a version, or as of an append time.
+
+        Starts from the nearest snapshot at or below the target version and
+        folds only the events between the snapshot and the target.
+        """
+        if (version is None) == (timestamp is None):
+            raise ValueError("Pass exactly one of `version` or `timestamp`")
+        if version is not None and version < 0:
+            raise ValueError(f"Invalid version `{version}`")
+        if timestamp is not None:
+            version = self.event_store.version_at(self.key, timestamp)
+        state, start = self.aggregate.initial_state(), 0
+        if self.snapshot_store is not None:
+            snapshot = self.snapshot_store.load(self.key, version)
+            if snapshot is not None:
+                state = self.state_deserializer(snapshot.state)
+                start = snapshot.version
+        events = self.event_store.load_events(self.key, start, version)
+        return fold(self.aggregate.evolve, state, events)
+
+    def __snapshot(
+        self, state: interfaces.DeciderAggregate.State, version: int, new_version: int
+    ) -> None:
+        if self.snapshot_store is None:
+            return
+        if new_version // self.snapshot_interval == version // self.snapshot_interval:
+            return
+        self.snapshot_store.save(self.key, new_version, self.state_serializer(state))
+
+
+class IdempotentDecider(interfaces.Decider):
+    """Wraps a runner so retried commands are answered from an index.
+
+    Commands are sent together with a caller-chosen command id. The events
+    produced the first time are remembered per stream, and a duplicate id is
+    answered with them directly, without loading, folding or deciding again.
+    Concurrent retries of the same id are serialized by the index, so only one
+    of them reaches the runner. Retries are only recognised by runners sharing
+    the index: use one `Index` per process, or a `SQLiteIndex` to survive
+    restarts and to share it between processes.
+    """
+
+    class Index:
+        def __init__(self, max_size: int = 1024, ttl: float | None = None) -> None:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.clock: Callable[[], float] = time.monotonic
+            self._streams: dict[
+                str,
+                collections.OrderedDict[
+                    str, tuple[float, list[interfaces.DeciderAggregate.Event]]
+                ],
+            ] = {}
+            self._claims: dict[tuple[str, str], list] = {}
+            self._lock = threading.Lock()
+
+        def lookup(
+            self, key: str, command_id: str
+        ) -> list[interfaces.DeciderAggregate.Event] | None:
+            with self._lock:
+                return self.__lookup(key, command_id)
+
+        def __lookup(
+            self, key: str, command_id: str
+        ) -> list[interfaces.DeciderAggregate.Event] | None:
+            entries = self._streams.get(key)
+            if entries is None or command_id not in entries:
+                return None
+            recorded_at, events = entries[command_id]
+            if self.ttl is not None and self.clock() - recorded_at > self.ttl:
+                del entries[command_id]
+                return None
+            return events
+
+        def record(
+            self,
+            key: str,
+            command_id: str,
+            events: list[interfaces.DeciderAggregate.Event],
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            """Records the events unless the id already has some; returns those."""
+            with self._lock:
+                recorded = self.__lookup(key, command_id)
+                if recorded is not None:
+                    return recorded
+                entries = self._streams.setdefault(key, collections.OrderedDict())
+                entries[command_id] = (self.clock(), events)
+                while len(entries) > self.max_size:
+                    entries.popitem(last=False)
+                return events
+
+        def execute(
+            self,
+            key: str,
+            command_id: str,
+            decide: Callable[[], list[interfaces.DeciderAggregate.Event]],
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            """Runs `decide` once per command id, even for concurrent retries."""
+            with self.__claim(key, command_id):
+                events = self.lookup(key, command_id)
+                if events is None:
+                    events = self.record(key, command_id, decide())
+                return events
+
+        @contextlib.contextmanager
+        def __claim(self, key: str, command_id: str) -> Iterator[None]:
+            with self._lock:
+                claim = self._claims.setdefault(
+                    (key, command_id), [threading.Lock(), 0]
+                )
+                claim[1] += 1
+            try:
+                with claim[0]:
+                    yield
+            finally:
+                with self._lock:
+                    claim[1] -= 1
+                    if claim[1] == 0:
+                        del self._claims[(key, command_id)]
+
+    class SQLiteIndex:
+        """Index persisted in SQLite, shared by every process opening the file.
+
+        `execute` claims a command id by inserting a pending row for it, runs
+        the decision outside any transaction and then stores the events in
+        that row, so only retries of the same id wait for each other; they
+        poll until the events are stored. A claim older than `claim_timeout`
+        seconds is taken to belong to a crashed process and is taken over.
+        Events are stored with the given serializer.
+        """
+
+        PENDING = "pending"
+        CREATE_TABLE = (
+            "CREATE TABLE IF NOT EXISTS commands (key TEXT NOT NULL,"
+            " command_id TEXT NOT NULL, recorded_at REAL NOT NULL,"
+            " events TEXT NOT NULL, PRIMARY KEY (key, command_id))"
+        )
+        SELECT = (
+            "SELECT recorded_at, events FROM commands"
+            " WHERE key = ? AND command_id = ?"
+        )
+        DELETE = "DELETE FROM commands WHERE key = ? AND command_id = ?"
+        RELEASE = (
+            "DELETE FROM commands WHERE key = ? AND command_id = ?"
+            " AND recorded_at = ? AND events = ?"
+        )
+        INSERT = (
+            "INSERT OR IGNORE INTO commands (key, command_id, recorded_at, events)"
+            " VALUES (?, ?, ?, ?)"
+        )
+        UPDATE = (
+            "UPDATE commands SET recorded_at = ?, events = ?"
+            " WHERE key = ? AND command_id = ? AND recorded_at = ? AND events = ?"
+        )
+        TRIM = (
+            "DELETE FROM commands WHERE key = ? AND events != ? AND command_id"
+            " NOT IN (SELECT command_id FROM commands WHERE key = ? AND events != ?"
+            " ORDER BY recorded_at DESC, rowid DESC LIMIT ?)"
+        )
+
+        def __init__(
+            self,
+            path: str,
+            serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+            deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+            max_size: int = 1024,
+            ttl: float | None = None,
+            claim_timeout: float = 30.0,
+            poll_interval: float = 0.002,
+        ) -> None:
+            import sqlite3
+
+            self.path = path
+            self.serializer = serializer
+            self.deserializer = deserializer
+            self.max_size = max_size
+            self.ttl = ttl
+            self.claim_timeout = claim_timeout
+            self.poll_interval = poll_interval
+            self.clock: Callable[[], float] = time.time
+            self._connection = sqlite3.connect(
+                path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(self.CREATE_TABLE)
+            self._lock = threading.RLock()
+
+        def close(self) -> None:
+            self._connection.close()
+
+        def lookup(
+            self, key: str, command_id: str
+        ) -> list[interfaces.DeciderAggregate.Event] | None:
+            with self._lock:
+                row = self._connection.execute(
+                    self.SELECT, (key, command_id)
+                ).fetchone()
+            if row is None or row[1] == self.PENDING or self.__expired(row[0]):
+                return None
+            return [self.deserializer(event) for event in json.loads(row[1])]
+
+        def __expired(self, recorded_at: float) -> bool:
+            return self.ttl is not None and self.clock() - recorded_at > self.ttl
+
+        def record(
+            self,
+            key: str,
+            command_id: str,
+            events: list[interfaces.DeciderAggregate.Event],
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            """Records the events unless the id already has some; returns those."""
+            with self._lock:
+                recorded = self.lookup(key, command_id)
+                if recorded is not None:
+                    return recorded
+                serialized = json.dumps([self.serializer(event) for event in events])
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self._connection.execute(self.DELETE, (key, command_id))
+                    self._connection.execute(
+                        self.INSERT, (key, command_id, self.clock(), serialized)
+                    )
+                    self.__trim(key)
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+                self._connection.execute("COMMIT")
+                return events
+
+        def execute(
+            self,
+            key: str,
+            command_id: str,
+            decide: Callable[[], list[interfaces.DeciderAggregate.Event]],
+        ) -> list[interfaces.DeciderAggregate.Event]:
+            """Runs `decide` once per command id, even across processes."""
+            while True:
+                claimed_at = self.clock()
+                with self._lock:
+                    claimed = self._connection.execute(
+                        self.INSERT, (key, command_id, claimed_at, self.PENDING)
+                    ).rowcount
+                    row = self._connection.execute(
+                        self.SELECT, (key, command_id)
+                    ).fetchone()
+                if claimed:
+                    break
+                if row is None:
+                    continue
+                recorded_at, serialized = row
+                pending = serialized == self.PENDING
+                if not pending and not self.__expired(recorded_at):
+                    return [self.deserializer(e) for e in json.loads(serialized)]
+                if not pending or self.clock() - recorded_at > self.claim_timeout:
+                    # Expired events and abandoned claims are dropped, unless
+                    # another caller replaced them in the meantime.
+                    with self._lock:
+                        self._connection.execute(
+                            self.RELEASE, (key, command_id, recorded_at, serialized)
+                        )
+                    continue
+                time.sleep(self.poll_interval)
+            try:
+                events = decide()
+                serialized = json.dumps([self.serializer(event) for event in events])
+            except BaseException:
+                with self._lock:
+                    self._connection.execute(
+                        self.RELEASE, (key, command_id, claimed_at, self.PENDING)
+                    )
+                raise
+            with self._lock:
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self._connection.execute(
+                        self.UPDATE,
+                        (
+                            self.clock(),
+                            serialized,
+                            key,
+                            command_id,
+                            claimed_at,
+                            self.PENDING,
+                        ),
+                    )
+                    self.__trim(key)
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+                self._connection.execute("COMMIT")
+            return events
+
+        def __trim(self, key: str) -> None:
+            self._connection.execute(
+                self.TRIM, (key, self.PENDING, key, self.PENDING, self.max_size)
+            )
+
+    def __init__(
+        self,
+        decider: interfaces.Decider,
+        key: str,
+        index: "IdempotentDecider.Index | IdempotentDecider.SQLiteIndex",
+    ) -> None:
+        self.decider = decider
+        self.key = key
+        self.index = index
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.decider})"
+
+    @profiling.profiled("decide", 0)
+    def decide(
+        self,
+        command: interfaces.DeciderAggregate.Command,
+        command_id: str | None = None,
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        if command_id is None:
+            return self.decider.decide(command)
+        events = self.index.execute(
+            self.key, command_id, lambda: self.decider.decide(command)
+        )
+        return list(events)
+
+    @property
+    def state(self) -> interfaces.DeciderAggregate.State:
+        return self.decider.state
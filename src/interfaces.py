@@ -1,5 +1,6 @@
 import abc
-from typing import List
+import bisect
+from typing import ClassVar, List
 
 
 # Define a custom metaclass that enforces the presence of type aliases
@@ -22,6 +23,9 @@ class DeciderAggregate(metaclass=DeciderMeta):
         pass
 
     class State(abc.ABC):
+        # An absorbing state evolves into itself for every event and decides no
+        # events, so folds and runners may stop as soon as they reach it.
+        absorbing: ClassVar[bool] = False
 
         @abc.abstractmethod
         def evolve(self, event: "DeciderAggregate.Event") -> "DeciderAggregate.State":
@@ -65,3 +69,63 @@ class Decider(abc.ABC):
         self, command: DeciderAggregate.Command, state: DeciderAggregate.State
     ) -> List[DeciderAggregate.Event]:
         raise NotImplementedError()
+
+
+class EventStore(abc.ABC):
+    @abc.abstractmethod
+    def load_stream(self, key: str) -> "infra.EventSourcingDecider.EventsStream":
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def append_to_stream(
+        self, key: str, expected_version: int, events: List[DeciderAggregate.Event]
+    ) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def keys(self) -> List[str]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def read_all(
+        self, position: int, limit: int
+    ) -> List["infra.EventSourcingDecider.RecordedEvent"]:
+        """Events of every stream in append order, after `position`.
+
+        Each recorded event carries the position to read from next, so the log
+        doubles as an outbox written in the same step as the stream itself.
+        """
+        raise NotImplementedError()
+
+    def load_events(
+        self, key: str, start: int, stop: int
+    ) -> List[DeciderAggregate.Event]:
+        return self.load_stream(key).events[start:stop]
+
+    def version_at(self, key: str, timestamp: float) -> int:
+        """Version of the stream once every event up to `timestamp` is applied."""
+        return bisect.bisect_right(self.load_stream(key).timestamps, timestamp)
+
+
+class StateStore(abc.ABC):
+    @abc.abstractmethod
+    def load(self, key: str) -> "infra.StateBasedDecider.StoredValue | None":
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def compare_and_swap(
+        self, key: str, expected_etag: "uuid.UUID | None", state: str
+    ) -> "infra.StateBasedDecider.StoredValue":
+        raise NotImplementedError()
+
+
+class SnapshotStore(abc.ABC):
+    @abc.abstractmethod
+    def save(self, key: str, version: int, state: str) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def load(
+        self, key: str, max_version: int | None = None
+    ) -> "infra.EventSourcingDecider.Snapshot | None":
+        raise NotImplementedError()
@@ -0,0 +1,419 @@
+"""Drives deciders with generated traffic and reports how they hold up.
+
+Usage:
+    PYTHONPATH=src python -m loadgen bulb event_sourcing --keys 1000 --zipf 1.1 \\
+        --mode thread --concurrency 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import collections
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import interfaces
+import serializers
+from decider import compose_decider_aggregates
+from deciders.bulb import Bulb
+from deciders.cat import Cat
+from infra import EventSourcingDecider, InMemoryDecider, StateBasedDecider
+
+CommandFactory = Callable[[random.Random], interfaces.DeciderAggregate.Command]
+
+COMMANDS: dict[str, CommandFactory] = {
+    "wake_up": lambda rng: Cat.WakeUpCommand(),
+    "go_to_sleep": lambda rng: Cat.GoToSleepCommand(),
+    "fit": lambda rng: Bulb.FitCommand(max_uses=rng.randint(1, 100)),
+    "switch_on": lambda rng: Bulb.SwitchOnCommand(),
+    "switch_off": lambda rng: Bulb.SwitchOffCommand(),
+}
+
+DEFAULT_MIX = {
+    "cat": "wake_up=1,go_to_sleep=1",
+    "bulb": "fit=1,switch_on=5,switch_off=5",
+    "cat_and_bulb": "wake_up=1,go_to_sleep=1,fit=1,switch_on=5,switch_off=5",
+}
+
+RUNNERS = ("in_memory", "state_based", "event_sourcing", "event_sourcing_file")
+
+
+@dataclasses.dataclass
+class Config:
+    decider: str = "bulb"
+    runner: str = "in_memory"
+    keys: int = 100
+    zipf: float = 0.0
+    mix: str = ""
+    mode: str = "thread"
+    concurrency: int = 1
+    commands: int | None = None
+    duration: float | None = 5.0
+    seed: int = 0
+    directory: str | None = None
+
+
+@dataclasses.dataclass
+class Stats:
+    """Mergeable counters, with latencies in power-of-two microsecond buckets."""
+
+    commands: int = 0
+    events: int = 0
+    conflicts: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    histogram: collections.Counter = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    def record(self, seconds: float) -> None:
+        self.histogram[max(int(seconds * 1_000_000), 1).bit_length()] += 1
+
+    def merge(self, other: "Stats") -> None:
+        self.commands += other.commands
+        self.events += other.events
+        self.conflicts += other.conflicts
+        self.errors += other.errors
+        self.elapsed = max(self.elapsed, other.elapsed)
+        self.histogram.update(other.histogram)
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound, in microseconds, of the bucket holding the percentile."""
+        target, seen = fraction * sum(self.histogram.values()), 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= target:
+                return 1 << bucket
+        return 0
+
+
+def parse_mix(mix: str) -> tuple[list[str], list[float]]:
+    names, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in COMMANDS:
+            raise ValueError(f"Unknown command `{name}`")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def aggregate_for(name: str) -> interfaces.DeciderAggregate:
+    if name == "cat":
+        return Cat
+    if name == "bulb":
+        return Bulb
+    return compose_decider_aggregates(Cat, Bulb)
+
+
+def _event_serializers(name: str) -> tuple[Callable, Callable]:
+    if name == "cat":
+        return serializers.cat_event_serializer, serializers.cat_event_deserializer
+    if name == "bulb":
+        return serializers.bulb_event_serializer, serializers.bulb_event_deserializer
+    raise ValueError(f"No event serializers for `{name}`")
+
+
+class Fleet:
+    """Creates one runner per key, all sharing the backing store."""
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.aggregate = aggregate_for(config.decider)
+        self.runners: dict[str, interfaces.Decider] = {}
+        self.event_store: interfaces.EventStore | None = None
+        self.state_store: interfaces.StateStore | None = None
+        if config.runner == "state_based":
+            self.state_store = StateBasedDecider.DictBasedStateStore()
+            self.cache = StateBasedDecider.StateCache(config.keys)
+        elif config.runner == "event_sourcing":
+            self.event_store = EventSourcingDecider.DictBasedEventStore()
+        elif config.runner == "event_sourcing_file":
+            serializer, deserializer = _event_serializers(config.decider)
+            self.event_store = EventSourcingDecider.FileBasedEventStore(
+                os.path.join(config.directory, "events.log"),
+                serializer,
+                deserializer,
+                fsync=False,
+            )
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        if isinstance(self.event_store, EventSourcingDecider.FileBasedEventStore):
+            self.event_store.close()
+
+    def runner(self, key: str) -> interfaces.Decider:
+        runner = self.runners.get(key)
+        if runner is None:
+            with self._lock:
+                runner = self.runners.get(key)
+                if runner is None:
+                    runner = self.runners[key] = self._create(key)
+        return runner
+
+    def _create(self, key: str) -> interfaces.Decider:
+        if self.config.runner == "in_memory":
+            return InMemoryDecider(self.aggregate)
+        if self.config.runner == "state_based":
+            serializer = getattr(serializers, f"{self.config.decider}_serializer")
+            deserializer = getattr(serializers, f"{self.config.decider}_deserializer")
+            return StateBasedDecider(
+                self.aggregate,
+                serializer,
+                deserializer,
+                self.state_store,
+                key,
+                self.cache,
+            )
+        return EventSourcingDecider(self.aggregate, key, self.event_store)
+
+
+class Traffic:
+    """Generates `(key, command)` pairs with Zipf-skewed key popularity."""
+
+    def __init__(self, config: Config, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.keys = [f"{config.decider}-{i}" for i in range(config.keys)]
+        weights = [1 / (rank**config.zipf) for rank in range(1, config.keys + 1)]
+        self.key_weights = list(itertools.accumulate(weights))
+        self.names, weights = parse_mix(config.mix or DEFAULT_MIX[config.decider])
+        self.command_weights = list(itertools.accumulate(weights))
+
+    def next(self) -> tuple[str, interfaces.DeciderAggregate.Command]:
+        [key] = self.rng.choices(self.keys, cum_weights=self.key_weights)
+        [name] = self.rng.choices(self.names, cum_weights=self.command_weights)
+        return key, COMMANDS[name](self.rng)
+
+
+def _send(fleet: Fleet, traffic: Traffic, stats: Stats) -> None:
+    key, command = traffic.next()
+    started = time.perf_counter()
+    try:
+        events = fleet.runner(key).decide(command)
+    except (RuntimeError, ValueError) as error:
+        # Lost races on the stream version or the state etag.
+        if str(error) in ("Concurrent stream write", "ETag mismatch"):
+            stats.conflicts += 1
+        else:
+            stats.errors += 1
+    except Exception:
+        stats.errors += 1
+    else:
+        stats.events += len(events)
+    stats.record(time.perf_counter() - started)
+    stats.commands += 1
+
+
+def _budget(config: Config, worker: int) -> int | None:
+    if config.commands is None:
+        return None
+    share, extra = divmod(config.commands, config.concurrency)
+    return share + (1 if worker < extra else 0)
+
+
+def _drive(fleet: Fleet, config: Config, worker: int, stats: Stats) -> None:
+    traffic = Traffic(config, config.seed * 1_000 + worker)
+    budget = _budget(config, worker)
+    started = time.perf_counter()
+    deadline = None if config.duration is None else started + config.duration
+    while (budget is None or stats.commands < budget) and (
+        deadline is None or time.perf_counter() < deadline
+    ):
+        _send(fleet, traffic, stats)
+    stats.elapsed = time.perf_counter() - started
+
+
+async def _drive_async(fleet: Fleet, config: Config, worker: int, stats: Stats):
+    traffic = Traffic(config, config.seed * 1_000 + worker)
+    budget = _budget(config, worker)
+    started = time.perf_counter()
+    deadline = None if config.duration is None else started + config.duration
+    while (budget is None or stats.commands < budget) and (
+        deadline is None or time.perf_counter() < deadline
+    ):
+        _send(fleet, traffic, stats)
+        await asyncio.sleep(0)
+    stats.elapsed = time.perf_counter() - started
+
+
+def _run_process(config: Config, worker: int, results: multiprocessing.Queue) -> None:
+    fleet, stats = Fleet(config), Stats()
+    try:
+        _drive(fleet, config, worker, stats)
+    finally:
+        fleet.close()
+        results.put(stats)
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(
+    config: Config,
+    sample: Callable[[float, int], None] | None = None,
+    sample_interval: float = 1.0,
+) -> Stats:
+    """Runs the load and returns the merged stats of all workers.
+
+    `sample` is called every `sample_interval` seconds with the time since the
+    start and the resident memory of the load generator and its workers.
+    """
+    if config.decider == "cat_and_bulb" and config.runner in (
+        "state_based",
+        "event_sourcing_file",
+    ):
+        raise ValueError("Composed deciders have no serializers")
+    with tempfile.TemporaryDirectory() as directory:
+        config = dataclasses.replace(config, directory=config.directory or directory)
+        pids = [os.getpid()]
+        done = threading.Event()
+        sampler = None
+        if sample is not None:
+            sampler = threading.Thread(
+                target=_sample, args=(sample, sample_interval, pids, done), daemon=True
+            )
+            sampler.start()
+        try:
+            return _run(config, pids)
+        finally:
+            done.set()
+            if sampler is not None:
+                sampler.join()
+
+
+def _sample(
+    sample: Callable[[float, int], None],
+    interval: float,
+    pids: list[int],
+    done: threading.Event,
+) -> None:
+    started = time.perf_counter()
+    while not done.wait(interval):
+        sample(time.perf_counter() - started, sum(_rss_bytes(pid) for pid in pids))
+
+
+def _run(config: Config, pids: list[int]) -> Stats:
+    total = Stats()
+    if config.mode == "process":
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_run_process, args=(config, i, results))
+            for i in range(config.concurrency)
+        ]
+        for process in processes:
+            process.start()
+            pids.append(process.pid)
+        for _ in processes:
+            total.merge(results.get())
+        for process in processes:
+            process.join()
+        return total
+
+    fleet = Fleet(config)
+    workers = [Stats() for _ in range(config.concurrency)]
+    try:
+        if config.mode == "thread":
+            threads = [
+                threading.Thread(target=_drive, args=(fleet, config, i, stats))
+                for i, stats in enumerate(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elif config.mode == "asyncio":
+
+            async def drive_all() -> None:
+                await asyncio.gather(
+                    *(
+                        _drive_async(fleet, config, i, stats)
+                        for i, stats in enumerate(workers)
+                    )
+                )
+
+            asyncio.run(drive_all())
+        else:
+            raise ValueError(f"Unknown mode `{config.mode}`")
+    finally:
+        fleet.close()
+    for stats in workers:
+        total.merge(stats)
+    return total
+
+
+def report(stats: Stats, file=sys.stdout) -> None:
+    rate = stats.commands / stats.elapsed if stats.elapsed else 0.0
+    print(f"commands:   {stats.commands} ({rate:.0f}/s)", file=file)
+    print(f"events:     {stats.events}", file=file)
+    conflicts = stats.conflicts / stats.commands if stats.commands else 0.0
+    print(f"conflicts:  {stats.conflicts} ({conflicts:.2%})", file=file)
+    print(f"errors:     {stats.errors}", file=file)
+    for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        print(f"latency {label}: <= {stats.percentile(fraction)} us", file=file)
+    print("latency histogram:", file=file)
+    largest = max(stats.histogram.values(), default=0)
+    for bucket in sorted(stats.histogram):
+        count = stats.histogram[bucket]
+        bar = "#" * max(1, round(40 * count / largest))
+        print(f"  <= {1 << bucket:>9} us {count:>10} {bar}", file=file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("decider", choices=sorted(DEFAULT_MIX))
+    parser.add_argument("runner", choices=RUNNERS)
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument(
+        "--zipf", type=float, default=0.0, help="key skew exponent, 0 is uniform"
+    )
+    parser.add_argument(
+        "--mix",
+        default="",
+        help="command weights, e.g. fit=1,switch_on=5 (see loadgen.COMMANDS)",
+    )
+    parser.add_argument(
+        "--mode", choices=("thread", "asyncio", "process"), default="thread"
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--commands", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = Config(
+        decider=args.decider,
+        runner=args.runner,
+        keys=args.keys,
+        zipf=args.zipf,
+        mix=args.mix,
+        mode=args.mode,
+        concurrency=args.concurrency,
+        commands=args.commands,
+        duration=args.duration,
+        seed=args.seed,
+    )
+    if config.commands is None and config.duration is None:
+        config.duration = 5.0
+
+    def sample(elapsed: float, rss: int) -> None:
+        print(f"t={elapsed:6.1f}s rss={rss / 1024 / 1024:8.1f} MiB", file=sys.stderr)
+
+    report(run(config, sample, args.sample_interval))
+
+
+if __name__ == "__main__":
+    main()
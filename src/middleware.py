@@ -0,0 +1,190 @@
+import collections
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+import interfaces
+
+Handler = Callable[[interfaces.DeciderAggregate.Command], list]
+Middleware = Callable[[interfaces.DeciderAggregate.Command, Handler], list]
+PostCommitHandler = Callable[
+    [list[tuple[str, interfaces.DeciderAggregate.Event]]], None
+]
+
+
+def authorization(
+    is_allowed: Callable[[interfaces.DeciderAggregate.Command], bool]
+) -> Middleware:
+    def authorize(
+        command: interfaces.DeciderAggregate.Command, next_handler: Handler
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        if not is_allowed(command):
+            raise PermissionError(f"Command `{command}` is not allowed")
+        return next_handler(command)
+
+    return authorize
+
+
+class Metrics:
+    """Middleware counting commands, events and time per command type."""
+
+    def __init__(self) -> None:
+        self.commands: collections.Counter[str] = collections.Counter()
+        self.events: collections.Counter[str] = collections.Counter()
+        self.errors: collections.Counter[str] = collections.Counter()
+        self.seconds: collections.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __call__(
+        self, command: interfaces.DeciderAggregate.Command, next_handler: Handler
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        name = type(command).__qualname__
+        started = time.perf_counter()
+        try:
+            events = next_handler(command)
+        except Exception:
+            with self._lock:
+                self.errors[name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.commands[name] += 1
+                self.seconds[name] += elapsed
+        with self._lock:
+            self.events[name] += len(events)
+        return events
+
+
+class PostCommitDispatcher:
+    """Hands committed events to handlers in batches, off the command path.
+
+    `publish` only enqueues; it blocks once `max_pending` events wait, which
+    pushes back on producers when handlers fall behind. A collector thread
+    groups events into batches of up to `max_batch`, waiting at most
+    `max_delay` seconds for a batch to fill, and runs every handler on each
+    batch in a pool of `max_workers` threads, with at most two batches queued
+    per thread.
+    """
+
+    def __init__(
+        self,
+        handlers: Iterable[PostCommitHandler],
+        max_batch: int = 100,
+        max_delay: float = 0.01,
+        max_workers: int = 2,
+        max_pending: int = 10_000,
+    ) -> None:
+        self.handlers = list(handlers)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.errors: list[Exception] = []
+        self._pending: queue.Queue = queue.Queue(max_pending)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        # Keeps batches from piling up in the executor while handlers are slow.
+        self._slots = threading.Semaphore(max_workers * 2)
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._collector = threading.Thread(target=self._run, daemon=True)
+        self._collector.start()
+
+    def publish(
+        self, key: str, events: list[interfaces.DeciderAggregate.Event]
+    ) -> None:
+        with self._idle:
+            self._in_flight += len(events)
+        for event in events:
+            self._pending.put((key, event))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Waits until every published event went through all handlers."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def close(self) -> None:
+        self.flush()
+        self._pending.put(None)
+        self._collector.join()
+        self._executor.shutdown()
+
+    def _run(self) -> None:
+        while True:
+            first = self._pending.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._pending.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._pending.put(None)
+                    break
+                batch.append(item)
+            self._slots.acquire()
+            self._executor.submit(self._handle, batch)
+
+    def _handle(
+        self, batch: list[tuple[str, interfaces.DeciderAggregate.Event]]
+    ) -> None:
+        for handler in self.handlers:
+            try:
+                handler(batch)
+            except Exception as error:
+                self.errors.append(error)
+        self._slots.release()
+        with self._idle:
+            self._in_flight -= len(batch)
+            self._idle.notify_all()
+
+
+class PipelineDecider(interfaces.Decider):
+    """Runs commands through middlewares around a runner.
+
+    A middleware receives the command and the next handler of the chain, so it
+    can validate or reject the command, measure the call or change its result.
+    Events returned by the runner are committed; they are then published to
+    the post-commit dispatcher, if any, without waiting for its handlers.
+    """
+
+    def __init__(
+        self,
+        decider: interfaces.Decider,
+        key: str,
+        middlewares: Iterable[Middleware] = (),
+        dispatcher: PostCommitDispatcher | None = None,
+    ) -> None:
+        self.decider = decider
+        self.key = key
+        self.middlewares = list(middlewares)
+        self.dispatcher = dispatcher
+        handler: Handler = decider.decide
+        for middleware in reversed(self.middlewares):
+            handler = self._chain(middleware, handler)
+        self._handler = handler
+
+    @staticmethod
+    def _chain(middleware: Middleware, next_handler: Handler) -> Handler:
+        return lambda command: middleware(command, next_handler)
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.decider})"
+
+    def decide(
+        self, command: interfaces.DeciderAggregate.Command
+    ) -> list[interfaces.DeciderAggregate.Event]:
+        events = self._handler(command)
+        if events and self.dispatcher is not None:
+            self.dispatcher.publish(self.key, events)
+        return events
+
+    @property
+    def state(self) -> interfaces.DeciderAggregate.State:
+        return self.decider.state
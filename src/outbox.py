@@ -0,0 +1,163 @@
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Callable, Iterable
+
+import interfaces
+from infra import EventSourcingDecider
+
+Batch = list[EventSourcingDecider.RecordedEvent]
+
+
+class QueueSink:
+    """Delivers to an in-process queue, blocking while the queue is full."""
+
+    def __init__(self, target: queue.Queue, timeout: float | None = None) -> None:
+        self.target = target
+        self.timeout = timeout
+
+    def send(self, batch: Batch) -> None:
+        for recorded in batch:
+            self.target.put(recorded, timeout=self.timeout)
+
+
+class FileSink:
+    """Appends one `position<TAB>key<TAB>event` line per event to a file."""
+
+    def __init__(
+        self,
+        path: str,
+        serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+    ) -> None:
+        self.path = path
+        self.serializer = serializer
+
+    def send(self, batch: Batch) -> None:
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(_lines(batch, self.serializer))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class UnixSocketSink:
+    """Streams the same lines as `FileSink` to a Unix domain socket."""
+
+    def __init__(
+        self,
+        path: str,
+        serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+    ) -> None:
+        self.path = path
+        self.serializer = serializer
+        self._socket: socket.socket | None = None
+
+    def send(self, batch: Batch) -> None:
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(self.path)
+        try:
+            self._socket.sendall("".join(_lines(batch, self.serializer)).encode())
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def _lines(
+    batch: Batch, serializer: Callable[[interfaces.DeciderAggregate.Event], str]
+) -> Iterable[str]:
+    for recorded in batch:
+        yield f"{recorded.position}\t{recorded.key}\t{serializer(recorded.event)}\n"
+
+
+class OutboxDispatcher:
+    """Drains an event store's log to sinks with at-least-once delivery.
+
+    Events are read in batches after the stored cursor and sent to every sink.
+    The cursor only moves, and is only persisted, once all sinks accepted the
+    batch, so a failing sink or a crash makes the batch be delivered again.
+    Sinks that block (e.g. a full bounded queue) slow the dispatcher down
+    rather than let undelivered events pile up in memory. Stores that keep
+    their log in memory expose `trim`, which is called with the cursor so
+    delivered events are dropped from the log; a `DictBasedEventStore` only
+    keeps that log when created with `outbox=True`.
+    """
+
+    def __init__(
+        self,
+        event_store: interfaces.EventStore,
+        sinks: Iterable,
+        cursor_path: str | None = None,
+        batch_size: int = 100,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.event_store = event_store
+        self.sinks = list(sinks)
+        self.cursor_path = cursor_path
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.clock: Callable[[], float] = time.time
+        self.position = self._read_cursor()
+        self.delivered = 0
+        self.failures = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _read_cursor(self) -> int:
+        if self.cursor_path is None or not os.path.exists(self.cursor_path):
+            return 0
+        with open(self.cursor_path, encoding="utf-8") as file:
+            return int(file.read())
+
+    def _write_cursor(self) -> None:
+        if self.cursor_path is None:
+            return
+        with open(f"{self.cursor_path}.tmp", "w", encoding="utf-8") as file:
+            file.write(str(self.position))
+        os.replace(f"{self.cursor_path}.tmp", self.cursor_path)
+
+    def drain_once(self) -> int:
+        """Delivers one batch and returns the number of events in it."""
+        batch = self.event_store.read_all(self.position, self.batch_size)
+        if not batch:
+            return 0
+        for sink in self.sinks:
+            sink.send(batch)
+        self.position = batch[-1].position
+        self._write_cursor()
+        trim = getattr(self.event_store, "trim", None)
+        if trim is not None:
+            trim(self.position)
+        self.delivered += len(batch)
+        self.lag = self.clock() - batch[-1].timestamp
+        self.max_lag = max(self.max_lag, self.lag)
+        return len(batch)
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                delivered = self.drain_once()
+            except Exception:
+                self.failures += 1
+                delivered = 0
+            if delivered < self.batch_size:
+                self._stopped.wait(self.poll_interval)
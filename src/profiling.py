@@ -0,0 +1,278 @@
+"""Opt-in profiling of folds, composed deciders and runners.
+
+While a `Profiler` is enabled, every profiled call records its wall time and
+memory use under its call stack, e.g.
+`EventSourcingDecider.decide:SwitchOnCommand;Bulb.evolve:SwitchedOnEvent`.
+Profiled methods run unwrapped until a profiler is enabled: `enabled`
+installs their wrappers on entry and removes them again on exit, and `fold`
+checks for an active profiler once per call, so profiling costs nothing while
+it is off.
+
+Memory is measured with process-wide counters, so allocations made by other
+threads during a call are attributed to it too; profile a single thread for
+exact figures. Per call, the profiler records:
+
+- `peak_bytes`: the most memory traced by `tracemalloc` above the level at
+  the start of the call, i.e. what the call needed while it ran;
+- `retained_bytes` and `retained_blocks`: the net change of traced bytes and
+  of `sys.getallocatedblocks()` over the call. A call that replaces a state
+  with a new one of the same size retains about nothing, and a call that
+  frees more than it allocates retains a negative amount.
+"""
+
+import collections
+import contextlib
+import dataclasses
+import functools
+import sys
+import threading
+import time
+import weakref
+from typing import Callable, Iterator
+
+ACTIVE: "Profiler | None" = None
+
+# Classes defining profiled methods, and how many `enabled` blocks are open.
+_owners: "weakref.WeakSet[type]" = weakref.WeakSet()
+_depth = 0
+_hooks_lock = threading.Lock()
+
+
+@dataclasses.dataclass
+class Entry:
+    calls: int = 0
+    seconds: float = 0.0
+    peak_bytes: int = 0
+    retained_bytes: int = 0
+    retained_blocks: int = 0
+    child_seconds: float = 0.0
+    child_retained_bytes: int = 0
+    child_retained_blocks: int = 0
+
+
+class Profiler:
+    def __init__(self, track_allocations: bool = True) -> None:
+        self.track_allocations = track_allocations
+        self.entries: dict[tuple[str, ...], Entry] = collections.defaultdict(Entry)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stacks(self) -> tuple[list[str], list[int]]:
+        """Frames of the current thread, and the peak memory seen in each."""
+        stacks = getattr(self._local, "stacks", None)
+        if stacks is None:
+            stacks = self._local.stacks = ([], [])
+        return stacks
+
+    @contextlib.contextmanager
+    def measure(self, frame: str) -> Iterator[None]:
+        frames, peaks = self._stacks()
+        frames.append(frame)
+        path = tuple(frames)
+        if self.track_allocations:
+            import tracemalloc
+
+            allocated, peak = tracemalloc.get_traced_memory()
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+            # The peak is reset for every frame; the enclosing frames get it
+            # back from `peaks` when this one ends.
+            tracemalloc.reset_peak()
+            peaks.append(allocated)
+            blocks = sys.getallocatedblocks()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            peak_bytes = retained_bytes = retained_blocks = 0
+            if self.track_allocations:
+                retained_blocks = sys.getallocatedblocks() - blocks
+                end_allocated, peak = tracemalloc.get_traced_memory()
+                peak = max(peaks.pop(), peak)
+                if peaks:
+                    peaks[-1] = max(peaks[-1], peak)
+                tracemalloc.reset_peak()
+                peak_bytes = peak - allocated
+                retained_bytes = end_allocated - allocated
+            frames.pop()
+            with self._lock:
+                entry = self.entries[path]
+                entry.calls += 1
+                entry.seconds += seconds
+                entry.peak_bytes = max(entry.peak_bytes, peak_bytes)
+                entry.retained_bytes += retained_bytes
+                entry.retained_blocks += retained_blocks
+                if len(path) > 1:
+                    parent = self.entries[path[:-1]]
+                    parent.child_seconds += seconds
+                    parent.child_retained_bytes += retained_bytes
+                    parent.child_retained_blocks += retained_blocks
+
+    def wrap_evolve(self, evolve_function: Callable) -> Callable:
+        """Profiles each call of an evolve function that is not profiled yet."""
+        if getattr(evolve_function, "__profiled__", False):
+            return evolve_function
+        owner = getattr(evolve_function, "__self__", None)
+        prefix = "evolve" if owner is None else f"{name(owner)}.evolve"
+
+        def evolve(state, event):
+            with self.measure(f"{prefix}:{type(event).__qualname__}"):
+                return evolve_function(state, event)
+
+        return evolve
+
+    def summary(self) -> dict[str, Entry]:
+        """Totals per frame, i.e. per (decider or runner, command or event).
+
+        `peak_bytes` is the largest peak of a single call, not a total.
+        """
+        totals: dict[str, Entry] = collections.defaultdict(Entry)
+        with self._lock:
+            for path, entry in self.entries.items():
+                total = totals[path[-1]]
+                total.calls += entry.calls
+                total.seconds += entry.seconds
+                total.peak_bytes = max(total.peak_bytes, entry.peak_bytes)
+                total.retained_bytes += entry.retained_bytes
+                total.retained_blocks += entry.retained_blocks
+        return dict(totals)
+
+    def collapsed(self, metric: str = "time") -> list[str]:
+        """Lines in the collapsed-stack format read by flamegraph tools.
+
+        Each line holds a stack and its own (exclusive) cost: microseconds for
+        `time`, or the net bytes or blocks for `retained_bytes` and
+        `retained_blocks`. Flamegraphs cannot draw negative costs, so frames
+        that freed more than they allocated are left out of those two.
+        """
+        lines = []
+        with self._lock:
+            for path, entry in sorted(self.entries.items()):
+                if metric == "time":
+                    value = round((entry.seconds - entry.child_seconds) * 1_000_000)
+                elif metric == "retained_bytes":
+                    value = entry.retained_bytes - entry.child_retained_bytes
+                elif metric == "retained_blocks":
+                    value = entry.retained_blocks - entry.child_retained_blocks
+                else:
+                    raise ValueError(f"Unknown metric `{metric}`")
+                if value > 0:
+                    lines.append(f"{';'.join(path)} {value}")
+        return lines
+
+    def dump_collapsed(self, path: str, metric: str = "time") -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(f"{line}\n" for line in self.collapsed(metric))
+
+
+@contextlib.contextmanager
+def enabled(profiler: Profiler | None = None) -> Iterator[Profiler]:
+    """Profiles everything run inside the block."""
+    global ACTIVE
+    import tracemalloc
+
+    profiler = Profiler() if profiler is None else profiler
+    started_tracing = profiler.track_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _enter()
+    previous, ACTIVE = ACTIVE, profiler
+    try:
+        yield profiler
+    finally:
+        ACTIVE = previous
+        _exit()
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def _enter() -> None:
+    global _depth
+    with _hooks_lock:
+        _depth += 1
+        if _depth == 1:
+            for owner in list(_owners):
+                for hook in owner.__dict__["_profiling_hooks"].values():
+                    hook.install(owner)
+
+
+def _exit() -> None:
+    global _depth
+    with _hooks_lock:
+        _depth -= 1
+        if _depth == 0:
+            for owner in list(_owners):
+                for hook in owner.__dict__["_profiling_hooks"].values():
+                    hook.uninstall(owner)
+
+
+class _Hook:
+    """Stands in for a profiled method while its class is being created.
+
+    On `__set_name__` the plain method takes its place again, and the class
+    is registered so that `enabled` can swap in the wrapper.
+    """
+
+    def __init__(self, method, kind: str, message_index: int) -> None:
+        self.method = method
+        function = method.__func__ if isinstance(method, classmethod) else method
+        parameter = function.__code__.co_varnames[message_index + 1]
+
+        @functools.wraps(function)
+        def wrapper(owner, *args, **kwargs):
+            profiler = ACTIVE
+            if profiler is None:
+                return function(owner, *args, **kwargs)
+            if message_index < len(args):
+                message = type(args[message_index]).__qualname__
+            else:
+                message = type(kwargs[parameter]).__qualname__
+            with profiler.measure(f"{name(owner)}.{kind}:{message}"):
+                return function(owner, *args, **kwargs)
+
+        wrapper.__profiled__ = True  # type: ignore[attr-defined]
+        self.wrapper = (
+            classmethod(wrapper) if isinstance(method, classmethod) else wrapper
+        )
+
+    def __set_name__(self, owner: type, attribute: str) -> None:
+        self.attribute = attribute
+        hooks = owner.__dict__.get("_profiling_hooks")
+        if hooks is None:
+            hooks = {}
+            setattr(owner, "_profiling_hooks", hooks)
+        hooks[attribute] = self
+        with _hooks_lock:
+            _owners.add(owner)
+            if _depth:
+                self.install(owner)
+            else:
+                self.uninstall(owner)
+
+    def install(self, owner: type) -> None:
+        setattr(owner, self.attribute, self.wrapper)
+
+    def uninstall(self, owner: type) -> None:
+        setattr(owner, self.attribute, self.method)
+
+
+def profiled(kind: str, message_index: int) -> Callable[[Callable], Callable]:
+    """Profiles a method under `<owner>.<kind>:<type of its message>`.
+
+    `message_index` is the position of the command or event among the
+    arguments following `self`/`cls`; it may also be passed by keyword.
+    Apply it above `classmethod` for class methods. Profiled methods must be
+    defined in a class body, where the class picks up their hook.
+    """
+
+    def decorate(method: Callable) -> Callable:
+        return _Hook(method, kind, message_index)  # type: ignore[return-value]
+
+    return decorate
+
+
+def name(owner) -> str:
+    """Frame name of a decider or runner, given the class or an instance."""
+    owner = owner if isinstance(owner, type) else type(owner)
+    return getattr(owner, "profile_name", owner.__name__)
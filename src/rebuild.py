@@ -0,0 +1,185 @@
+"""Rebuilds the state of every stream in an event log into a snapshot store.
+
+Usage:
+    PYTHONPATH=src python -m rebuild bulb events.log snapshots.db --workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from typing import Callable, Iterator, Type
+
+import interfaces
+import serializers
+from deciders.bulb import Bulb
+from deciders.cat import Cat
+from infra import EventSourcingDecider, fold
+
+DECIDERS = {
+    "cat": (Cat, serializers.cat_event_deserializer, serializers.cat_serializer),
+    "bulb": (Bulb, serializers.bulb_event_deserializer, serializers.bulb_serializer),
+}
+
+_worker_store: EventSourcingDecider.FileBasedEventStore | None = None
+_worker_aggregate: Type[interfaces.DeciderAggregate] | None = None
+_worker_serializer: Callable[[interfaces.DeciderAggregate.State], str] | None = None
+
+
+def _start_worker(
+    aggregate: Type[interfaces.DeciderAggregate],
+    path: str,
+    event_deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+    state_serializer: Callable[[interfaces.DeciderAggregate.State], str],
+) -> None:
+    global _worker_store, _worker_aggregate, _worker_serializer
+    # The log is only read, so the event serializer is never called.
+    _worker_store = EventSourcingDecider.FileBasedEventStore(
+        path, str, event_deserializer, fsync=False
+    )
+    _worker_aggregate = aggregate
+    _worker_serializer = state_serializer
+
+
+def _rebuild_chunk(keys: list[str]) -> list[tuple[str, int, str]]:
+    snapshots = []
+    for key in keys:
+        stream = _worker_store.load_stream(key)
+        state = fold(
+            _worker_aggregate.evolve, _worker_aggregate.initial_state(), stream.events
+        )
+        snapshots.append((key, stream.version, _worker_serializer(state)))
+    return snapshots
+
+
+def _chunks(keys: list[str], chunk_size: int) -> Iterator[list[str]]:
+    for start in range(0, len(keys), chunk_size):
+        yield keys[start : start + chunk_size]
+
+
+def _read_checkpoint(path: str | None) -> dict[str, int]:
+    """Versions snapshotted by an interrupted run, keyed by stream."""
+    if path is None or not os.path.exists(path):
+        return {}
+    done = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            key, _, version = line.rstrip("\n").rpartition("\t")
+            if key:
+                done[key] = int(version)
+    return done
+
+
+def rebuild(
+    aggregate: Type[interfaces.DeciderAggregate],
+    path: str,
+    event_deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+    state_serializer: Callable[[interfaces.DeciderAggregate.State], str],
+    snapshot_store: interfaces.SnapshotStore,
+    workers: int | None = None,
+    chunk_size: int = 100,
+    checkpoint: str | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Folds every stream of the log at `path` and saves it as a snapshot.
+
+    Keys are split into chunks that idle workers pick up as they finish their
+    previous one. Finished keys are appended to the `checkpoint` file with the
+    version they were snapshotted at, so an interrupted rebuild resumes where
+    it stopped, while streams that got new events since are rebuilt again.
+    The checkpoint is removed once a run completes, so the next rebuild starts
+    over. Returns the number of streams rebuilt by this call.
+    """
+    event_store = EventSourcingDecider.FileBasedEventStore(
+        path, str, event_deserializer, fsync=False
+    )
+    try:
+        versions = {
+            key: event_store.version_at(key, float("inf"))
+            for key in event_store.keys()
+        }
+    finally:
+        event_store.close()
+    checkpointed = _read_checkpoint(checkpoint)
+    pending = [
+        key for key, version in versions.items() if checkpointed.get(key) != version
+    ]
+    total, rebuilt = len(versions), 0
+    skipped = total - len(pending)
+    save_many = getattr(snapshot_store, "save_many", None)
+
+    with multiprocessing.Pool(
+        workers,
+        initializer=_start_worker,
+        initargs=(aggregate, path, event_deserializer, state_serializer),
+    ) as pool:
+        checkpoint_file = (
+            open(checkpoint, "a", encoding="utf-8") if checkpoint else None
+        )
+        try:
+            for snapshots in pool.imap_unordered(
+                _rebuild_chunk, _chunks(pending, chunk_size)
+            ):
+                if save_many is not None:
+                    save_many(snapshots)
+                else:
+                    for key, version, state in snapshots:
+                        snapshot_store.save(key, version, state)
+                if checkpoint_file is not None:
+                    checkpoint_file.writelines(
+                        f"{key}\t{version}\n" for key, version, _ in snapshots
+                    )
+                    checkpoint_file.flush()
+                rebuilt += len(snapshots)
+                if progress is not None:
+                    progress(skipped + rebuilt, total)
+        finally:
+            if checkpoint_file is not None:
+                checkpoint_file.close()
+    if checkpoint is not None:
+        os.remove(checkpoint)
+    return rebuilt
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("decider", choices=sorted(DECIDERS))
+    parser.add_argument("events", help="path of the event log")
+    parser.add_argument("snapshots", help="path of the SQLite snapshot database")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--checkpoint", default=None)
+    args = parser.parse_args()
+
+    aggregate, event_deserializer, state_serializer = DECIDERS[args.decider]
+    snapshot_store = EventSourcingDecider.SQLiteSnapshotStore(args.snapshots)
+    started = time.perf_counter()
+
+    def report(done: int, total: int) -> None:
+        elapsed = time.perf_counter() - started
+        print(
+            f"\r{done}/{total} streams ({done / elapsed:.0f}/s)",
+            end="",
+            file=sys.stderr,
+        )
+
+    try:
+        rebuilt = rebuild(
+            aggregate,
+            args.events,
+            event_deserializer,
+            state_serializer,
+            snapshot_store,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            checkpoint=args.checkpoint,
+            progress=report,
+        )
+    finally:
+        snapshot_store.close()
+    print(f"\nRebuilt {rebuilt} streams", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
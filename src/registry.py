@@ -0,0 +1,50 @@
+import importlib
+import threading
+from typing import Type
+
+import interfaces
+
+
+class DeciderRegistry:
+    """Registers deciders by name without importing their modules.
+
+    A decider is registered as a `"module:attribute"` target and its module is
+    only imported when the decider, or one of its commands, is first needed.
+    Hosts with many deciders therefore pay only for the ones they use.
+    """
+
+    def __init__(self) -> None:
+        self._targets: dict[str, str] = {}
+        self._loaded: dict[str, Type[interfaces.DeciderAggregate]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, target: str) -> None:
+        if name in self._targets:
+            raise ValueError(f"Decider `{name}` is already registered")
+        self._targets[name] = target
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def get(self, name: str) -> Type[interfaces.DeciderAggregate]:
+        aggregate = self._loaded.get(name)
+        if aggregate is not None:
+            return aggregate
+        with self._lock:
+            if name not in self._loaded:
+                if name not in self._targets:
+                    raise KeyError(f"Unknown decider `{name}`")
+                module_name, _, attribute = self._targets[name].partition(":")
+                module = importlib.import_module(module_name)
+                self._loaded[name] = getattr(module, attribute)
+            return self._loaded[name]
+
+    def command(
+        self, command_type: str, **fields
+    ) -> interfaces.DeciderAggregate.Command:
+        """Builds a command from its `"Decider.CommandName"` type name."""
+        name, _, command_name = command_type.partition(".")
+        command_class = getattr(self.get(name), command_name)
+        if not issubclass(command_class, interfaces.DeciderAggregate.Command):
+            raise ValueError(f"`{command_type}` is not a command")
+        return command_class(**fields)
@@ -0,0 +1,232 @@
+"""Compact, read-only segments sealed from an event log.
+
+A segment stores every stream of an event store in a few bytes per event:
+
+- each distinct serialized event is written once, in a dictionary, and
+  streams refer to it by index;
+- streams are run-length encoded as repeated patterns of up to `MAX_PERIOD`
+  indices, so `On, Off, On, Off, ...` is a single `(2, repeats, on, off)` run;
+- append times are kept exactly: the bit patterns of their float64 values
+  are delta encoded, which leaves small, compressible deltas for times that
+  only grow;
+- the whole body is optionally compressed with zlib or, when the
+  `zstandard` package is installed, zstd.
+
+Loading a stream deserializes nothing: dictionary entries are deserialized
+once when the segment is opened, and runs expand by repeating the shared
+(immutable) event objects.
+"""
+
+import itertools
+import struct
+import zlib
+from typing import Callable
+
+import interfaces
+from infra import EventSourcingDecider
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"DSEG2"
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+MAX_PERIOD = 4
+_INT64 = 1 << 63
+
+_COUNT = struct.Struct("<I")
+_STREAM = struct.Struct("<HII")
+
+
+def encode(
+    streams: dict[str, tuple[list[str], list[float]]], compression: str = "zlib"
+) -> bytes:
+    """Encodes `{key: (payloads, timestamps)}` into a segment."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression `{compression}`")
+    dictionary: dict[str, int] = {}
+    body = bytearray()
+    for key, (payloads, timestamps) in streams.items():
+        indices = [dictionary.setdefault(p, len(dictionary)) for p in payloads]
+        tokens = _runs(indices)
+        count = len(timestamps)
+        bits = struct.unpack(f"<{count}q", struct.pack(f"<{count}d", *timestamps))
+        deltas = [_wrap(b - a) for a, b in zip((0,) + bits, bits)]
+        key_bytes = key.encode("utf-8")
+        body += _STREAM.pack(len(key_bytes), len(tokens), len(indices))
+        body += key_bytes
+        body += struct.pack(f"<{len(tokens)}I", *tokens)
+        body += struct.pack(f"<{len(deltas)}q", *deltas)
+
+    header = bytearray(_COUNT.pack(len(dictionary)))
+    for payload in dictionary:
+        payload_bytes = payload.encode("utf-8")
+        header += _COUNT.pack(len(payload_bytes)) + payload_bytes
+    header += _COUNT.pack(len(streams))
+    return MAGIC + bytes([COMPRESSIONS[compression]]) + _compress(
+        bytes(header + body), compression
+    )
+
+
+def _wrap(value: int) -> int:
+    """`value` wrapped into the signed 64-bit range."""
+    return (value + _INT64) % (2 * _INT64) - _INT64
+
+
+def _runs(indices: list[int]) -> list[int]:
+    """Flattened `(period, repeats, *pattern)` runs covering `indices`."""
+    tokens: list[int] = []
+    position, length = 0, len(indices)
+    while position < length:
+        best_period, best_repeats = 1, 1
+        for period in range(1, MAX_PERIOD + 1):
+            pattern = indices[position : position + period]
+            if len(pattern) < period:
+                break
+            repeats = 1
+            start = position + period
+            while indices[start : start + period] == pattern:
+                repeats += 1
+                start += period
+            if repeats > 1 and period * repeats > best_period * best_repeats:
+                best_period, best_repeats = period, repeats
+        tokens.append(best_period)
+        tokens.append(best_repeats)
+        tokens.extend(indices[position : position + best_period])
+        position += best_period * best_repeats
+    return tokens
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, 9)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires the `zstandard` package")
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSIONS["zlib"]:
+        return zlib.decompress(data)
+    if compression == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise ImportError("zstd compression requires the `zstandard` package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def seal(
+    event_store: interfaces.EventStore,
+    path: str,
+    serializer: Callable[[interfaces.DeciderAggregate.Event], str],
+    compression: str = "zlib",
+) -> int:
+    """Writes every stream of `event_store` to a segment; returns its size."""
+    streams = {}
+    for key in event_store.keys():
+        stream = event_store.load_stream(key)
+        streams[key] = ([serializer(e) for e in stream.events], stream.timestamps)
+    data = encode(streams, compression)
+    with open(path, "wb") as file:
+        file.write(data)
+    return len(data)
+
+
+class SegmentEventStore(interfaces.EventStore):
+    """Read-only event store over a sealed segment."""
+
+    def __init__(
+        self,
+        path: str,
+        deserializer: Callable[[str], interfaces.DeciderAggregate.Event],
+    ) -> None:
+        with open(path, "rb") as file:
+            data = file.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"`{path}` is not a segment")
+        self._body = _decompress(data[len(MAGIC) + 1 :], data[len(MAGIC)])
+        self._events: list[interfaces.DeciderAggregate.Event] = []
+        self._streams: dict[str, tuple[int, int, int]] = {}
+        self._index(deserializer)
+
+    def _index(
+        self, deserializer: Callable[[str], interfaces.DeciderAggregate.Event]
+    ) -> None:
+        body = self._body
+        [count], position = _COUNT.unpack_from(body), _COUNT.size
+        for _ in range(count):
+            [length] = _COUNT.unpack_from(body, position)
+            position += _COUNT.size
+            payload = str(body[position : position + length], "utf-8")
+            self._events.append(deserializer(payload))
+            position += length
+        [count] = _COUNT.unpack_from(body, position)
+        position += _COUNT.size
+        for _ in range(count):
+            key_length, tokens, events = _STREAM.unpack_from(body, position)
+            position += _STREAM.size
+            key = str(body[position : position + key_length], "utf-8")
+            position += key_length
+            self._streams[key] = (position, tokens, events)
+            position += 4 * tokens + 8 * events
+
+    def keys(self) -> list[str]:
+        return list(self._streams)
+
+    def load_stream(self, key: str) -> "EventSourcingDecider.EventsStream":
+        if key not in self._streams:
+            return EventSourcingDecider.EventsStream()
+        position, token_count, event_count = self._streams[key]
+        tokens = struct.unpack_from(f"<{token_count}I", self._body, position)
+        deltas = struct.unpack_from(
+            f"<{event_count}q", self._body, position + 4 * token_count
+        )
+        events: list[interfaces.DeciderAggregate.Event] = []
+        shared, index = self._events, 0
+        while index < token_count:
+            period, repeats = tokens[index], tokens[index + 1]
+            pattern = [shared[i] for i in tokens[index + 2 : index + 2 + period]]
+            events.extend(pattern * repeats)
+            index += 2 + period
+        bits = list(itertools.accumulate(deltas))
+        if bits and (min(bits) < -_INT64 or max(bits) >= _INT64):
+            bits = [_wrap(b) for b in bits]
+        packed = struct.pack(f"<{event_count}q", *bits)
+        timestamps = list(struct.unpack(f"<{event_count}d", packed))
+        return EventSourcingDecider.EventsStream(events, event_count, timestamps)
+
+    def append_to_stream(
+        self,
+        key: str,
+        expected_version: int,
+        events: list[interfaces.DeciderAggregate.Event],
+    ) -> None:
+        raise RuntimeError("Sealed segments are read-only")
+
+    def read_all(
+        self, position: int, limit: int
+    ) -> list["EventSourcingDecider.RecordedEvent"]:
+        """Reads events stream after stream; positions count events."""
+        recorded: list[EventSourcingDecider.RecordedEvent] = []
+        offset = 0
+        for key, (_, _, count) in self._streams.items():
+            if len(recorded) >= limit:
+                break
+            if position < offset + count:
+                stream = self.load_stream(key)
+                for index in range(max(position - offset, 0), count):
+                    if len(recorded) >= limit:
+                        break
+                    recorded.append(
+                        EventSourcingDecider.RecordedEvent(
+                            key,
+                            stream.events[index],
+                            stream.timestamps[index],
+                            offset + index + 1,
+                        )
+                    )
+            offset += count
+        return recorded
@@ -37,3 +37,43 @@ def bulb_deserializer(text: str) -> interfaces.DeciderAggregate.State:
     if text == "blown":
         return bulb.Bulb.BlownState()
     raise Exception(f"Unknown state: {text}")
+
+
+def cat_event_serializer(event: interfaces.DeciderAggregate.Event) -> str:
+    if isinstance(event, cat.Cat.WokeUpEvent):
+        return "woke_up"
+    if isinstance(event, cat.Cat.GotToSleepEvent):
+        return "got_to_sleep"
+    raise Exception(f"Unknown event: {event}")
+
+
+def cat_event_deserializer(text: str) -> interfaces.DeciderAggregate.Event:
+    if text == "woke_up":
+        return cat.Cat.WokeUpEvent()
+    if text == "got_to_sleep":
+        return cat.Cat.GotToSleepEvent()
+    raise Exception(f"Unknown event: {text}")
+
+
+def bulb_event_serializer(event: interfaces.DeciderAggregate.Event) -> str:
+    if isinstance(event, bulb.Bulb.FittedEvent):
+        return f"fitted:{event.max_uses}"
+    if isinstance(event, bulb.Bulb.SwitchedOnEvent):
+        return "switched_on"
+    if isinstance(event, bulb.Bulb.SwitchedOffEvent):
+        return "switched_off"
+    if isinstance(event, bulb.Bulb.BlewEvent):
+        return "blew"
+    raise Exception(f"Unknown event: {event}")
+
+
+def bulb_event_deserializer(text: str) -> interfaces.DeciderAggregate.Event:
+    if text.startswith("fitted:"):
+        return bulb.Bulb.FittedEvent(int(text[len("fitted:") :]))
+    if text == "switched_on":
+        return bulb.Bulb.SwitchedOnEvent()
+    if text == "switched_off":
+        return bulb.Bulb.SwitchedOffEvent()
+    if text == "blew":
+        return bulb.Bulb.BlewEvent()
+    raise Exception(f"Unknown event: {text}")
@@ -1,17 +1,61 @@
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
 import unittest
 
+import loadgen
+import profiling
+import segments
+from cluster import ConsistentHashRing, ShardedCluster
 from decider import compose_decider_aggregates
 from deciders.bulb import Bulb
 from deciders.cat import Cat
-from infra import EventSourcingDecider, InMemoryDecider, StateBasedDecider
+from infra import (
+    EventSourcingDecider,
+    IdempotentDecider,
+    InMemoryDecider,
+    InMemoryDeciderFleet,
+    StateBasedDecider,
+    fold,
+    footprint,
+)
+from middleware import (
+    Metrics,
+    PipelineDecider,
+    PostCommitDispatcher,
+    authorization,
+)
+from outbox import FileSink, OutboxDispatcher, QueueSink, UnixSocketSink
+from rebuild import rebuild
+from registry import DeciderRegistry
 from serializers import (
     bulb_deserializer,
+    bulb_event_deserializer,
+    bulb_event_serializer,
     bulb_serializer,
     cat_deserializer,
+    cat_event_deserializer,
+    cat_event_serializer,
     cat_serializer,
 )
 
 
+def file_based_event_store(
+    test_case: unittest.TestCase, serializer, deserializer
+) -> EventSourcingDecider.FileBasedEventStore:
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    store = EventSourcingDecider.FileBasedEventStore(
+        os.path.join(directory.name, "events.log"), serializer, deserializer
+    )
+    test_case.addCleanup(store.close)
+    return store
+
+
 class BulbTests(unittest.TestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -20,6 +64,13 @@ class BulbTests(unittest.TestCase):
             InMemoryDecider(Bulb),
             StateBasedDecider(Bulb, bulb_serializer, bulb_deserializer, {}, "bulb"),
             EventSourcingDecider(Bulb, "bulb"),
+            EventSourcingDecider(
+                Bulb,
+                "bulb",
+                file_based_event_store(
+                    self, bulb_event_serializer, bulb_event_deserializer
+                ),
+            ),
         ]
 
     def test_fit_bulb(self):
@@ -143,6 +194,13 @@ class CatTests(unittest.TestCase):
             InMemoryDecider(Cat),
             StateBasedDecider(Cat, cat_serializer, cat_deserializer, {}, "cat"),
             EventSourcingDecider(Cat, "cat"),
+            EventSourcingDecider(
+                Cat,
+                "cat",
+                file_based_event_store(
+                    self, cat_event_serializer, cat_event_deserializer
+                ),
+            ),
         ]
 
     def test_is_terminal(self):
@@ -198,6 +256,1143 @@ class CatTests(unittest.TestCase):
                 self.assertEqual(result, [Cat.WokeUpEvent()])
 
 
+class FileBasedEventStoreTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+
+    def test_load_unknown_stream(self):
+        stream = self.store.load_stream("missing")
+        self.assertEqual(stream.events, [])
+        self.assertEqual(stream.version, 0)
+
+    def test_torn_tail_record_is_dropped_by_the_next_append(self):
+        self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=3)])
+        size = os.path.getsize(self.store.path)
+        record = self.store._encode("b", [Bulb.SwitchedOnEvent()], 0.0)
+        with open(self.store.path, "ab") as file:
+            file.write(record[: len(record) // 2])
+
+        store = EventSourcingDecider.FileBasedEventStore(
+            self.store.path, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.addCleanup(store.close)
+        store.append_to_stream("b", 0, [Bulb.FittedEvent(max_uses=7)])
+        appended = store._encode("b", [Bulb.FittedEvent(max_uses=7)], 0.0)
+        self.assertEqual(os.path.getsize(store.path), size + len(appended))
+
+        reopened = EventSourcingDecider.FileBasedEventStore(
+            self.store.path, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.load_stream("a").events, [Bulb.FittedEvent(3)])
+        self.assertEqual(reopened.load_stream("b").events, [Bulb.FittedEvent(7)])
+
+    def test_streams_are_indexed_per_key(self):
+        self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=3)])
+        self.store.append_to_stream("b", 0, [Bulb.FittedEvent(max_uses=7)])
+        self.store.append_to_stream(
+            "a", 1, [Bulb.SwitchedOnEvent(), Bulb.SwitchedOffEvent()]
+        )
+
+        stream = self.store.load_stream("a")
+        self.assertEqual(
+            stream.events,
+            [
+                Bulb.FittedEvent(max_uses=3),
+                Bulb.SwitchedOnEvent(),
+                Bulb.SwitchedOffEvent(),
+            ],
+        )
+        self.assertEqual(stream.version, 3)
+        self.assertEqual(self.store.load_stream("b").version, 1)
+
+    def test_concurrent_write_is_rejected(self):
+        self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=3)])
+        with self.assertRaises(RuntimeError):
+            self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=3)])
+
+    def test_reopened_log_sees_previous_appends(self):
+        self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=3)])
+        other = EventSourcingDecider.FileBasedEventStore(
+            self.store.path, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.addCleanup(other.close)
+        other.append_to_stream("a", 1, [Bulb.SwitchedOnEvent()])
+
+        self.assertEqual(
+            self.store.load_stream("a").events,
+            [Bulb.FittedEvent(max_uses=3), Bulb.SwitchedOnEvent()],
+        )
+
+
+class GroupCommitEventStoreTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.file_store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.writes = 0
+        write = self.file_store._write
+
+        def counting_write(data: bytes) -> None:
+            self.writes += 1
+            write(data)
+
+        self.file_store._write = counting_write
+        self.store = EventSourcingDecider.GroupCommitEventStore(
+            self.file_store, max_latency=0.05
+        )
+        self.addCleanup(self.store.close)
+
+    def test_append_batch_fails_only_conflicting_appends(self):
+        errors = self.file_store.append_batch(
+            [
+                ("a", 0, [Bulb.FittedEvent(max_uses=1)]),
+                ("a", 0, [Bulb.FittedEvent(max_uses=2)]),
+                ("a", 1, [Bulb.SwitchedOnEvent()]),
+            ]
+        )
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], RuntimeError)
+        self.assertIsNone(errors[2])
+        self.assertEqual(self.file_store.load_stream("a").version, 2)
+        self.assertEqual(self.writes, 1)
+
+    def test_append_batch_fails_only_unencodable_appends(self):
+        errors = self.file_store.append_batch(
+            [
+                ("k" * 70_000, 0, [Bulb.FittedEvent(max_uses=1)]),
+                ("a", 0, [Bulb.FittedEvent(max_uses=2)]),
+                ("a", 1, [Bulb.SwitchedOnEvent()]),
+            ]
+        )
+        self.assertIsInstance(errors[0], struct.error)
+        self.assertEqual(errors[1:], [None, None])
+        self.assertEqual(self.file_store.keys(), ["a"])
+        self.assertEqual(self.file_store.load_stream("a").version, 2)
+
+    def test_serializer_error_fails_only_its_append(self):
+        errors = self.file_store.append_batch(
+            [
+                ("a", 0, [Bulb.FittedEvent(max_uses=1)]),
+                ("b", 0, [Bulb.FittedEvent(max_uses=1), Bulb.FitCommand(max_uses=1)]),
+                ("b", 0, [Bulb.FittedEvent(max_uses=2)]),
+            ]
+        )
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], Exception)
+        self.assertIsNone(errors[2])
+        self.assertEqual(self.file_store.load_stream("b").events, [Bulb.FittedEvent(2)])
+
+    def test_append_after_close_raises(self):
+        self.store.close()
+        with self.assertRaises(RuntimeError):
+            self.store.append_to_stream("a", 0, [Bulb.FittedEvent(max_uses=1)])
+
+    def test_concurrent_appends_share_a_write(self):
+        def append(key: str) -> None:
+            self.store.append_to_stream(key, 0, [Bulb.FittedEvent(max_uses=1)])
+
+        threads = [
+            threading.Thread(target=append, args=(f"bulb-{i}",)) for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(8):
+            self.assertEqual(self.store.load_stream(f"bulb-{i}").version, 1)
+        self.assertLess(self.writes, 8)
+
+    def test_conflicting_append_raises(self):
+        decider = EventSourcingDecider(Bulb, "bulb", self.store)
+        decider.decide(Bulb.FitCommand(max_uses=1))
+        with self.assertRaises(RuntimeError):
+            self.store.append_to_stream("bulb", 0, [Bulb.FittedEvent(max_uses=1)])
+        self.assertIsInstance(decider.state, Bulb.WorkingState)
+
+
+class StateStoreTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sqlite_store = StateBasedDecider.SQLiteStateStore(
+            os.path.join(directory.name, "states.db"), pool_size=2
+        )
+        self.addCleanup(sqlite_store.close)
+        file_store = StateBasedDecider.FileBasedStateStore(
+            os.path.join(directory.name, "states")
+        )
+        self.addCleanup(file_store.close)
+        self.stores = [
+            StateBasedDecider.DictBasedStateStore(),
+            sqlite_store,
+            file_store,
+        ]
+
+    def test_compare_and_swap_rotates_etag(self):
+        for store in self.stores:
+            with self.subTest(store=store.__class__.__name__):
+                first = store.compare_and_swap("bulb", None, "not_fitted")
+                second = store.compare_and_swap("bulb", first.etag, "blown")
+                self.assertNotEqual(first.etag, second.etag)
+                self.assertEqual(store.load("bulb"), second)
+
+    def test_stale_etag_is_rejected(self):
+        for store in self.stores:
+            with self.subTest(store=store.__class__.__name__):
+                first = store.compare_and_swap("bulb", None, "not_fitted")
+                store.compare_and_swap("bulb", first.etag, "working:Off:5")
+                with self.assertRaises(ValueError):
+                    store.compare_and_swap("bulb", first.etag, "blown")
+                with self.assertRaises(ValueError):
+                    store.compare_and_swap("bulb", None, "blown")
+                self.assertEqual(store.load("bulb").state, "working:Off:5")
+
+    def test_keys_do_not_collide_with_store_files(self):
+        for store in self.stores:
+            with self.subTest(store=store.__class__.__name__):
+                temporary = store.compare_and_swap("x.tmp", None, "not_fitted")
+                store.compare_and_swap("x", None, "blown")
+                self.assertEqual(store.load("x.tmp"), temporary)
+                self.assertIsNone(store.load(".lock"))
+                lock = store.compare_and_swap(".lock", None, "blown")
+                self.assertEqual(store.load(".lock"), lock)
+                store.compare_and_swap("x", store.load("x").etag, "not_fitted")
+
+    def test_deciders_share_a_store(self):
+        for store in self.stores:
+            with self.subTest(store=store.__class__.__name__):
+                first = StateBasedDecider(
+                    Bulb, bulb_serializer, bulb_deserializer, store, "shared"
+                )
+                second = StateBasedDecider(
+                    Bulb, bulb_serializer, bulb_deserializer, store, "shared"
+                )
+                first.decide(Bulb.FitCommand(max_uses=5))
+                second.decide(Bulb.SwitchOnCommand())
+                self.assertEqual(first.state, Bulb.WorkingState("On", 4))
+
+
+class StateCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.deserialized: list[str] = []
+
+        def counting_deserializer(text: str):
+            self.deserialized.append(text)
+            return bulb_deserializer(text)
+
+        self.store = StateBasedDecider.DictBasedStateStore()
+        self.decider = StateBasedDecider(
+            Bulb, bulb_serializer, counting_deserializer, self.store, "bulb"
+        )
+
+    def test_unchanged_etag_reuses_live_state(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        self.decider.decide(Bulb.SwitchOnCommand())
+        self.decider.decide(Bulb.SwitchOffCommand())
+        self.assertIs(self.decider.state, self.decider.state)
+        self.assertEqual(self.deserialized, [])
+
+    def test_changed_etag_deserializes_again(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        etag = self.store.load("bulb").etag
+        self.store.compare_and_swap("bulb", etag, "working:On:4")
+        self.assertEqual(self.decider.state, Bulb.WorkingState("On", 4))
+        self.assertEqual(self.deserialized, ["working:On:4"])
+
+    def test_no_events_skips_store(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        stored_value = self.store.load("bulb")
+        self.assertEqual(self.decider.decide(Bulb.SwitchOffCommand()), [])
+        self.assertIs(self.store.load("bulb"), stored_value)
+
+    def test_cache_is_bounded(self):
+        cache = StateBasedDecider.StateCache(max_size=2)
+        for key in ("a", "b", "c"):
+            decider = StateBasedDecider(
+                Bulb, bulb_serializer, bulb_deserializer, self.store, key, cache
+            )
+            decider.decide(Bulb.FitCommand(max_uses=1))
+        self.assertIsNone(cache.get("a", self.store.load("a").etag))
+        self.assertIsNotNone(cache.get("c", self.store.load("c").etag))
+
+
+class IdempotentDeciderTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.index = IdempotentDecider.Index(max_size=2, ttl=10)
+        self.now = 0.0
+        self.index.clock = lambda: self.now
+        self.runner = EventSourcingDecider(Bulb, "bulb")
+        self.decider = IdempotentDecider(self.runner, "bulb", self.index)
+
+    def test_duplicate_command_returns_previous_events(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        first = self.decider.decide(Bulb.SwitchOnCommand(), command_id="cmd-1")
+        self.decider.decide(Bulb.SwitchOffCommand())
+        retry = self.decider.decide(Bulb.SwitchOnCommand(), command_id="cmd-1")
+
+        self.assertEqual(first, [Bulb.SwitchedOnEvent()])
+        self.assertEqual(retry, first)
+        self.assertEqual(self.runner.event_store.load_stream("bulb").version, 3)
+
+    def test_expired_command_runs_again(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5), command_id="cmd-1")
+        self.now = 11.0
+        self.assertEqual(
+            self.decider.decide(Bulb.FitCommand(max_uses=5), command_id="cmd-1"), []
+        )
+
+    def test_index_is_bounded_per_stream(self):
+        self.index.record("bulb", "a", [])
+        self.index.record("bulb", "b", [])
+        self.index.record("bulb", "c", [])
+        self.index.record("other", "a", [])
+        self.assertIsNone(self.index.lookup("bulb", "a"))
+        self.assertEqual(self.index.lookup("bulb", "c"), [])
+        self.assertEqual(self.index.lookup("other", "a"), [])
+
+    def test_record_keeps_the_first_result(self):
+        first = self.index.record("bulb", "a", [Bulb.SwitchedOnEvent()])
+        second = self.index.record("bulb", "a", [])
+        self.assertEqual(second, first)
+        self.assertEqual(self.index.lookup("bulb", "a"), [Bulb.SwitchedOnEvent()])
+
+    def test_concurrent_retries_run_once(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        started = threading.Event()
+        decide = self.runner.decide
+
+        def slow_decide(command):
+            started.set()
+            time.sleep(0.05)
+            return decide(command)
+
+        self.runner.decide = slow_decide
+        results = []
+
+        def retry():
+            results.append(
+                self.decider.decide(Bulb.SwitchOnCommand(), command_id="cmd-1")
+            )
+
+        threads = [threading.Thread(target=retry) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(started.is_set())
+        self.assertEqual(results, [[Bulb.SwitchedOnEvent()]] * 4)
+        self.assertEqual(self.runner.event_store.load_stream("bulb").version, 2)
+
+    def test_sqlite_index_survives_restarts(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "commands.db")
+        store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+
+        def runner() -> IdempotentDecider:
+            index = IdempotentDecider.SQLiteIndex(
+                path, bulb_event_serializer, bulb_event_deserializer
+            )
+            self.addCleanup(index.close)
+            return IdempotentDecider(
+                EventSourcingDecider(Bulb, "bulb", store), "bulb", index
+            )
+
+        runner().decide(Bulb.FitCommand(max_uses=5), command_id="cmd-1")
+        first = runner().decide(Bulb.SwitchOnCommand(), command_id="cmd-2")
+        retry = runner().decide(Bulb.SwitchOnCommand(), command_id="cmd-2")
+
+        self.assertEqual(first, [Bulb.SwitchedOnEvent()])
+        self.assertEqual(retry, first)
+        self.assertEqual(store.load_stream("bulb").version, 2)
+
+
+    def sqlite_index(self) -> IdempotentDecider.SQLiteIndex:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        index = IdempotentDecider.SQLiteIndex(
+            os.path.join(directory.name, "commands.db"),
+            bulb_event_serializer,
+            bulb_event_deserializer,
+        )
+        self.addCleanup(index.close)
+        return index
+
+    def test_sqlite_index_runs_different_keys_concurrently(self):
+        index = self.sqlite_index()
+        both_deciding = threading.Barrier(2, timeout=5)
+
+        def decide() -> list[Bulb.Event]:
+            both_deciding.wait()
+            return [Bulb.SwitchedOnEvent()]
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda key=key: results.append(
+                    index.execute(key, "cmd-1", decide)
+                )
+            )
+            for key in ("a", "b")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertFalse(both_deciding.broken)
+        self.assertEqual(results, [[Bulb.SwitchedOnEvent()]] * 2)
+
+    def test_sqlite_index_runs_concurrent_retries_once(self):
+        index = self.sqlite_index()
+        calls = []
+
+        def decide() -> list[Bulb.Event]:
+            calls.append(None)
+            time.sleep(0.05)
+            return [Bulb.SwitchedOnEvent()]
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(index.execute("a", "cmd-1", decide))
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[Bulb.SwitchedOnEvent()]] * 4)
+
+    def test_sqlite_index_releases_failed_claims(self):
+        index = self.sqlite_index()
+
+        def fail() -> list[Bulb.Event]:
+            raise RuntimeError("Concurrent stream write")
+
+        with self.assertRaises(RuntimeError):
+            index.execute("a", "cmd-1", fail)
+        self.assertEqual(
+            index.execute("a", "cmd-1", lambda: [Bulb.BlewEvent()]),
+            [Bulb.BlewEvent()],
+        )
+        self.assertEqual(index.lookup("a", "cmd-1"), [Bulb.BlewEvent()])
+
+
+class ShardedClusterTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cluster = ShardedCluster(
+            Bulb,
+            os.path.join(directory.name, "events.log"),
+            bulb_event_serializer,
+            bulb_event_deserializer,
+            workers=2,
+        )
+        self.addCleanup(self.cluster.close)
+
+    def test_ring_moves_few_keys_when_a_worker_joins(self):
+        ring = ConsistentHashRing()
+        ring.add(0)
+        ring.add(1)
+        keys = [f"bulb-{i}" for i in range(200)]
+        before = {key: ring.worker_for(key) for key in keys}
+        ring.add(2)
+        moved = [key for key in keys if ring.worker_for(key) != before[key]]
+        self.assertTrue(all(ring.worker_for(key) == 2 for key in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+    def test_commands_are_routed_to_workers(self):
+        for i in range(10):
+            self.cluster.decide(f"bulb-{i}", Bulb.FitCommand(max_uses=3))
+        self.assertEqual(
+            self.cluster.decide("bulb-4", Bulb.SwitchOnCommand()),
+            [Bulb.SwitchedOnEvent()],
+        )
+        self.assertEqual(self.cluster.state("bulb-4"), Bulb.WorkingState("On", 2))
+
+    def test_keys_survive_rebalancing(self):
+        for i in range(10):
+            self.cluster.decide(f"bulb-{i}", Bulb.FitCommand(max_uses=3))
+        self.cluster.add_worker()
+        for i in range(10):
+            self.assertEqual(
+                self.cluster.decide(f"bulb-{i}", Bulb.SwitchOnCommand()),
+                [Bulb.SwitchedOnEvent()],
+            )
+        self.assertEqual(self.cluster.workers, 3)
+
+
+class DeciderRegistryTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.registry = DeciderRegistry()
+        self.registry.register("Bulb", "deciders.bulb:Bulb")
+
+    def test_decider_is_loaded_on_first_use(self):
+        self.assertFalse(self.registry.is_loaded("Bulb"))
+        command = self.registry.command("Bulb.FitCommand", max_uses=3)
+        self.assertTrue(self.registry.is_loaded("Bulb"))
+        self.assertEqual(command, Bulb.FitCommand(max_uses=3))
+        self.assertIs(self.registry.get("Bulb"), Bulb)
+
+    def test_unknown_decider(self):
+        with self.assertRaises(KeyError):
+            self.registry.get("Cat")
+
+    def test_composed_deciders_are_cached(self):
+        self.assertIs(
+            compose_decider_aggregates(Cat, Bulb),
+            compose_decider_aggregates(Cat, Bulb),
+        )
+        self.assertIsNot(
+            compose_decider_aggregates(Cat, Bulb),
+            compose_decider_aggregates(Bulb, Cat),
+        )
+
+
+class RebuildTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.event_store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        for i in range(20):
+            decider = EventSourcingDecider(Bulb, f"bulb-{i}", self.event_store)
+            decider.decide(Bulb.FitCommand(max_uses=i))
+            decider.decide(Bulb.SwitchOnCommand())
+        self.checkpoint = self.event_store.path + ".checkpoint"
+        self.snapshot_store = EventSourcingDecider.SQLiteSnapshotStore(
+            self.event_store.path + ".db"
+        )
+        self.addCleanup(self.snapshot_store.close)
+
+    def rebuild(self, **kwargs) -> int:
+        return rebuild(
+            Bulb,
+            self.event_store.path,
+            bulb_event_deserializer,
+            bulb_serializer,
+            self.snapshot_store,
+            workers=2,
+            chunk_size=3,
+            checkpoint=self.checkpoint,
+            **kwargs,
+        )
+
+    def test_rebuild_saves_snapshots_of_every_stream(self):
+        progress = []
+        rebuilt = self.rebuild(progress=lambda *args: progress.append(args))
+
+        self.assertEqual(rebuilt, 20)
+        self.assertEqual(progress[-1], (20, 20))
+        for i in (0, 1, 7):
+            snapshot = self.snapshot_store.load(f"bulb-{i}")
+            self.assertEqual(snapshot.version, 2)
+            decider = EventSourcingDecider(Bulb, f"bulb-{i}", self.event_store)
+            self.assertEqual(snapshot.state, bulb_serializer(decider.state))
+
+    def test_rebuild_resumes_from_checkpoint(self):
+        with open(self.checkpoint, "w") as file:
+            file.writelines(f"bulb-{i}\t2\n" for i in range(15))
+        self.assertEqual(self.rebuild(), 5)
+        self.assertIsNone(self.snapshot_store.load("bulb-0"))
+        self.assertIsNotNone(self.snapshot_store.load("bulb-19"))
+
+    def test_streams_changed_since_checkpoint_are_rebuilt(self):
+        with open(self.checkpoint, "w") as file:
+            file.writelines(f"bulb-{i}\t2\n" for i in range(20))
+        EventSourcingDecider(Bulb, "bulb-3", self.event_store).decide(
+            Bulb.SwitchOffCommand()
+        )
+        self.assertEqual(self.rebuild(), 1)
+        self.assertEqual(self.snapshot_store.load("bulb-3").version, 3)
+
+    def test_completed_run_clears_checkpoint(self):
+        self.assertEqual(self.rebuild(), 20)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertEqual(self.rebuild(), 20)
+
+    def test_snapshot_store_loads_latest_version_below_limit(self):
+        store = EventSourcingDecider.DictBasedSnapshotStore()
+        for snapshot_store in (store, self.snapshot_store):
+            snapshot_store.save("bulb", 10, "working:Off:3")
+            snapshot_store.save("bulb", 20, "blown")
+            snapshot_store.save("bulb", 15, "working:On:2")
+            snapshot_store.save("bulb", 15, "working:Off:2")
+            self.assertEqual(snapshot_store.load("bulb").version, 20)
+            self.assertEqual(snapshot_store.load("bulb", 14).state, "working:Off:3")
+            self.assertEqual(snapshot_store.load("bulb", 15).state, "working:Off:2")
+            self.assertIsNone(snapshot_store.load("bulb", 5))
+
+
+class TemporalQueryTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.now = 0.0
+        dict_store = EventSourcingDecider.DictBasedEventStore()
+        file_store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.deciders = []
+        for store in (dict_store, file_store):
+            store.clock = lambda: self.now
+            self.deciders.append(
+                EventSourcingDecider(
+                    Bulb,
+                    "bulb",
+                    store,
+                    EventSourcingDecider.DictBasedSnapshotStore(),
+                    bulb_serializer,
+                    bulb_deserializer,
+                    snapshot_interval=4,
+                )
+            )
+
+    def switch_bulb(self, decider: EventSourcingDecider) -> None:
+        decider.decide(Bulb.FitCommand(max_uses=10))
+        for minute in range(1, 10):
+            self.now = minute * 60.0
+            decider.decide(Bulb.SwitchOnCommand())
+            decider.decide(Bulb.SwitchOffCommand())
+
+    def test_state_at_version(self):
+        for decider in self.deciders:
+            with self.subTest(store=decider.event_store.__class__.__name__):
+                self.switch_bulb(decider)
+                self.assertIsInstance(decider.state_at(version=0), Bulb.NotFittedState)
+                self.assertEqual(
+                    decider.state_at(version=1), Bulb.WorkingState("Off", 10)
+                )
+                self.assertEqual(
+                    decider.state_at(version=6), Bulb.WorkingState("On", 7)
+                )
+                self.assertEqual(decider.state_at(version=19), decider.state)
+
+    def test_state_at_timestamp(self):
+        for decider in self.deciders:
+            with self.subTest(store=decider.event_store.__class__.__name__):
+                self.now = 0.0
+                self.switch_bulb(decider)
+                self.assertEqual(
+                    decider.state_at(timestamp=0.0), Bulb.WorkingState("Off", 10)
+                )
+                self.assertEqual(
+                    decider.state_at(timestamp=150.0), Bulb.WorkingState("Off", 8)
+                )
+
+    def test_state_at_folds_from_nearest_snapshot(self):
+        decider = self.deciders[0]
+        self.switch_bulb(decider)
+        snapshots = decider.snapshot_store.storage["bulb"]
+        self.assertEqual(sorted(snapshots), [4, 8, 12, 16])
+        self.assertEqual(snapshots[4], bulb_serializer(Bulb.WorkingState("On", 8)))
+        # A tampered snapshot shows which versions start from it.
+        decider.snapshot_store.save("bulb", 8, bulb_serializer(Bulb.BlownState()))
+        self.assertIsInstance(decider.state_at(version=10), Bulb.BlownState)
+        self.assertIsInstance(decider.state_at(version=7), Bulb.WorkingState)
+
+    def test_state_at_needs_one_target(self):
+        with self.assertRaises(ValueError):
+            self.deciders[0].state_at()
+        with self.assertRaises(ValueError):
+            self.deciders[0].state_at(version=1, timestamp=1.0)
+
+    def test_state_at_rejects_negative_versions(self):
+        self.switch_bulb(self.deciders[0])
+        with self.assertRaises(ValueError):
+            self.deciders[0].state_at(version=-1)
+
+    def test_snapshot_store_needs_state_serializers(self):
+        with self.assertRaises(ValueError):
+            EventSourcingDecider(
+                Bulb,
+                "bulb",
+                snapshot_store=EventSourcingDecider.DictBasedSnapshotStore(),
+            )
+
+
+class AbsorbingStateTests(unittest.TestCase):
+    def test_fold_stops_at_absorbing_state(self):
+        evolved = []
+
+        def evolve(state, event):
+            evolved.append(event)
+            return Bulb.evolve(state, event)
+
+        events = [Bulb.FittedEvent(max_uses=0), Bulb.BlewEvent()]
+        events += [Bulb.SwitchedOnEvent()] * 100
+        state = fold(evolve, Bulb.initial_state(), events)
+
+        self.assertIsInstance(state, Bulb.BlownState)
+        self.assertEqual(len(evolved), 2)
+
+    def test_runners_skip_the_store_once_absorbed(self):
+        event_store = EventSourcingDecider.DictBasedEventStore()
+        loads = []
+        load_stream = event_store.load_stream
+        event_store.load_stream = lambda key: loads.append(key) or load_stream(key)
+        state_store = StateBasedDecider.DictBasedStateStore()
+        load = state_store.load
+        state_store.load = lambda key: loads.append(key) or load(key)
+        deciders = [
+            EventSourcingDecider(Bulb, "bulb", event_store),
+            StateBasedDecider(
+                Bulb, bulb_serializer, bulb_deserializer, state_store, "bulb"
+            ),
+        ]
+        for decider in deciders:
+            with self.subTest(decider=decider.__class__.__name__):
+                decider.decide(Bulb.FitCommand(max_uses=0))
+                blew = decider.decide(Bulb.SwitchOnCommand())
+                self.assertEqual(blew, [Bulb.BlewEvent()])
+                loads.clear()
+
+                self.assertEqual(decider.decide(Bulb.SwitchOnCommand()), [])
+                self.assertIsInstance(decider.state, Bulb.BlownState)
+                self.assertEqual(loads, [])
+
+    def test_combined_state_is_absorbing_when_both_sides_are(self):
+        two_bulbs = compose_decider_aggregates(Bulb, Bulb)
+        state = two_bulbs.CombinedState(Bulb.BlownState(), Bulb.NotFittedState())
+        self.assertFalse(state.absorbing)
+        self.assertIs(two_bulbs.evolve(state, Bulb.SwitchedOnEvent()), state)
+        state = two_bulbs.CombinedState(Bulb.BlownState(), Bulb.BlownState())
+        self.assertTrue(state.absorbing)
+
+
+class PipelineDeciderTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.batches = []
+        self.dispatcher = PostCommitDispatcher(
+            [self.batches.append], max_batch=3, max_delay=0.01
+        )
+        self.addCleanup(self.dispatcher.close)
+        self.metrics = Metrics()
+        self.decider = PipelineDecider(
+            InMemoryDecider(Bulb),
+            "bulb",
+            [
+                authorization(lambda command: command != Bulb.FitCommand(max_uses=0)),
+                self.metrics,
+            ],
+            self.dispatcher,
+        )
+
+    def test_middlewares_wrap_the_runner(self):
+        with self.assertRaises(PermissionError):
+            self.decider.decide(Bulb.FitCommand(max_uses=0))
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        self.decider.decide(Bulb.SwitchOffCommand())
+
+        self.assertEqual(self.metrics.commands["Bulb.FitCommand"], 1)
+        self.assertEqual(self.metrics.events["Bulb.FitCommand"], 1)
+        self.assertEqual(self.metrics.commands["Bulb.SwitchOffCommand"], 1)
+        self.assertEqual(self.metrics.events["Bulb.SwitchOffCommand"], 0)
+
+    def test_committed_events_reach_handlers_in_batches(self):
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+        for _ in range(3):
+            self.decider.decide(Bulb.SwitchOnCommand())
+            self.decider.decide(Bulb.SwitchOffCommand())
+
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        published = [item for batch in self.batches for item in batch]
+        self.assertEqual(len(published), 7)
+        self.assertEqual(published[0], ("bulb", Bulb.FittedEvent(max_uses=5)))
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+
+    def test_handler_errors_are_collected(self):
+        def failing_handler(batch):
+            raise RuntimeError("sink down")
+
+        self.dispatcher.handlers.insert(0, failing_handler)
+        self.decider.decide(Bulb.FitCommand(max_uses=5))
+
+        self.assertTrue(self.dispatcher.flush(timeout=5))
+        self.assertIsInstance(self.dispatcher.errors[0], RuntimeError)
+        self.assertEqual(len(self.batches), 1)
+
+
+class OutboxDispatcherTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.event_store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.cursor = self.event_store.path + ".cursor"
+        for key in ("a", "b"):
+            decider = EventSourcingDecider(Bulb, key, self.event_store)
+            decider.decide(Bulb.FitCommand(max_uses=5))
+            decider.decide(Bulb.SwitchOnCommand())
+
+    def test_log_is_read_in_append_order(self):
+        dict_store = EventSourcingDecider.DictBasedEventStore(outbox=True)
+        for event_store in (dict_store, self.event_store):
+            with self.subTest(store=event_store.__class__.__name__):
+                decider = EventSourcingDecider(Bulb, "c", event_store)
+                decider.decide(Bulb.FitCommand(max_uses=5))
+                recorded = event_store.read_all(0, 100)
+                self.assertEqual(recorded[-1].key, "c")
+                self.assertEqual(recorded[-1].event, Bulb.FittedEvent(max_uses=5))
+                self.assertEqual(event_store.read_all(recorded[-1].position, 100), [])
+
+    def test_batches_are_delivered_and_cursor_persisted(self):
+        delivered = queue.Queue()
+        dispatcher = OutboxDispatcher(
+            self.event_store, [QueueSink(delivered)], self.cursor, batch_size=3
+        )
+        self.assertEqual(dispatcher.drain_once(), 3)
+        self.assertEqual(dispatcher.drain_once(), 1)
+        self.assertEqual(dispatcher.drain_once(), 0)
+        self.assertEqual([delivered.get().key for _ in range(4)], ["a", "a", "b", "b"])
+
+        EventSourcingDecider(Bulb, "a", self.event_store).decide(
+            Bulb.SwitchOffCommand()
+        )
+        resumed = OutboxDispatcher(
+            self.event_store, [QueueSink(delivered)], self.cursor
+        )
+        self.assertEqual(resumed.drain_once(), 1)
+        self.assertEqual(delivered.get().event, Bulb.SwitchedOffEvent())
+
+    def test_in_memory_log_is_opt_in(self):
+        event_store = EventSourcingDecider.DictBasedEventStore()
+        EventSourcingDecider(Bulb, "a", event_store).decide(Bulb.FitCommand(5))
+        self.assertEqual(event_store.log, [])
+        with self.assertRaises(RuntimeError):
+            event_store.read_all(0, 100)
+
+    def test_delivered_events_are_trimmed_from_in_memory_log(self):
+        event_store = EventSourcingDecider.DictBasedEventStore(outbox=True)
+        decider = EventSourcingDecider(Bulb, "a", event_store)
+        decider.decide(Bulb.FitCommand(max_uses=5))
+        decider.decide(Bulb.SwitchOnCommand())
+        delivered = queue.Queue()
+        dispatcher = OutboxDispatcher(event_store, [QueueSink(delivered)])
+
+        self.assertEqual(dispatcher.drain_once(), 2)
+        self.assertEqual(event_store.log, [])
+        decider.decide(Bulb.SwitchOffCommand())
+        [recorded] = event_store.read_all(dispatcher.position, 100)
+        self.assertEqual(recorded.position, 3)
+        self.assertEqual(dispatcher.drain_once(), 1)
+        self.assertEqual(event_store.load_stream("a").version, 3)
+
+    def test_failed_delivery_is_retried(self):
+        path = self.event_store.path + ".out"
+        sink = FileSink(path, bulb_event_serializer)
+        full_sink = QueueSink(queue.Queue(1), timeout=0)
+        dispatcher = OutboxDispatcher(self.event_store, [sink, full_sink])
+        with self.assertRaises(queue.Full):
+            dispatcher.drain_once()
+        self.assertEqual(dispatcher.position, 0)
+
+        dispatcher.sinks = [sink]
+        self.assertEqual(dispatcher.drain_once(), 4)
+        with open(path) as file:
+            lines = file.read().splitlines()
+        # At least once: the first batch reached the file sink twice.
+        self.assertEqual(len(lines), 8)
+        self.assertTrue(lines[-1].endswith("\tb\tswitched_on"))
+
+    def test_unix_socket_sink(self):
+        path = self.event_store.path + ".sock"
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(path)
+        server.listen(1)
+        sink = UnixSocketSink(path, bulb_event_serializer)
+        self.addCleanup(sink.close)
+
+        dispatcher = OutboxDispatcher(self.event_store, [sink])
+        dispatcher.start()
+        connection, _ = server.accept()
+        self.addCleanup(connection.close)
+        received = b""
+        while received.count(b"\n") < 4:
+            received += connection.recv(4096)
+        dispatcher.stop()
+
+        self.assertEqual(dispatcher.delivered, 4)
+        self.assertIn(b"\ta\tfitted:5\n", received)
+
+
+class InMemoryDeciderFleetTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fleet = InMemoryDeciderFleet(
+            Bulb,
+            bulb_serializer,
+            bulb_deserializer,
+            os.path.join(directory.name, "spill"),
+            memory_budget=3 * footprint(Bulb.WorkingState("Off", 5)),
+        )
+        self.addCleanup(self.fleet.close)
+
+    def test_cold_deciders_are_spilled_within_budget(self):
+        for i in range(10):
+            self.fleet.decide(f"bulb-{i}", Bulb.FitCommand(max_uses=i))
+
+        self.assertLessEqual(self.fleet.memory, self.fleet.memory_budget)
+        self.assertEqual(len(self.fleet), 3)
+        self.assertTrue(self.fleet.is_resident("bulb-9"))
+        self.assertFalse(self.fleet.is_resident("bulb-0"))
+        self.assertEqual(self.fleet.stats.evictions, 7)
+
+    def test_spilled_deciders_are_reloaded(self):
+        for i in range(10):
+            self.fleet.decide(f"bulb-{i}", Bulb.FitCommand(max_uses=5))
+        self.fleet.decide("bulb-0", Bulb.SwitchOnCommand())
+
+        self.assertEqual(self.fleet.stats.misses, 11)
+        self.assertEqual(self.fleet.state("bulb-0"), Bulb.WorkingState("On", 4))
+        self.assertEqual(self.fleet.stats.hits, 1)
+        self.assertEqual(self.fleet.decide("bulb-0", Bulb.FitCommand(max_uses=1)), [])
+
+    def test_reading_a_spilled_state_keeps_it_spilled(self):
+        for i in range(10):
+            self.fleet.decide(f"bulb-{i}", Bulb.FitCommand(max_uses=5))
+
+        self.assertEqual(self.fleet.state("bulb-0"), Bulb.WorkingState("Off", 5))
+        self.assertIsInstance(self.fleet.state("unknown"), Bulb.NotFittedState)
+        self.assertFalse(self.fleet.is_resident("bulb-0"))
+        self.assertFalse(self.fleet.is_resident("unknown"))
+        self.assertTrue(self.fleet.is_resident("bulb-7"))
+        self.assertEqual(self.fleet.stats.evictions, 7)
+        self.assertEqual(self.fleet.stats.misses, 12)
+
+
+class LoadGeneratorTests(unittest.TestCase):
+    def test_modes_run_the_requested_commands(self):
+        for mode in ("thread", "asyncio", "process"):
+            with self.subTest(mode=mode):
+                config = loadgen.Config(
+                    decider="bulb",
+                    runner="event_sourcing_file",
+                    keys=5,
+                    zipf=1.0,
+                    mode=mode,
+                    concurrency=2,
+                    commands=201,
+                    duration=None,
+                )
+                stats = loadgen.run(config)
+                self.assertEqual(stats.commands, 201)
+                self.assertEqual(sum(stats.histogram.values()), 201)
+                self.assertEqual(stats.errors, 0)
+                self.assertGreater(stats.events, 0)
+
+    def test_zipf_skews_key_popularity(self):
+        traffic = loadgen.Traffic(loadgen.Config(keys=100, zipf=1.5), seed=0)
+        keys = [traffic.next()[0] for _ in range(1000)]
+        self.assertGreater(keys.count("bulb-0"), keys.count("bulb-50") * 10)
+
+    def test_composed_decider_has_no_state_serializer(self):
+        config = loadgen.Config(decider="cat_and_bulb", runner="state_based")
+        with self.assertRaises(ValueError):
+            loadgen.run(config)
+
+
+class ProfilingTests(unittest.TestCase):
+    def test_time_and_allocations_are_attributed_per_decider_and_message(self):
+        aggregate = compose_decider_aggregates(Cat, Bulb)
+        decider = InMemoryDecider(aggregate)
+        with profiling.enabled() as profiler:
+            decider.decide(Bulb.FitCommand(max_uses=5))
+            decider.decide(Bulb.SwitchOnCommand())
+            decider.decide(Bulb.SwitchOnCommand())
+
+        summary = profiler.summary()
+        self.assertEqual(
+            summary["InMemoryDecider.decide:Bulb.SwitchOnCommand"].calls, 2
+        )
+        evolve = summary["ComposedDecider(Cat,Bulb).evolve:Bulb.SwitchedOnEvent"]
+        self.assertEqual(evolve.calls, 1)
+        self.assertGreater(evolve.seconds, 0)
+        self.assertGreater(
+            summary["ComposedDecider(Cat,Bulb).decide:Bulb.FitCommand"].peak_bytes, 0
+        )
+
+    def test_peak_counts_memory_freed_before_returning(self):
+        class Scratch:
+            @profiling.profiled("decide", 0)
+            def decide(self, command):
+                buffer = bytearray(100_000)
+                return [len(buffer)]
+
+        with profiling.enabled() as profiler:
+            with profiler.measure("outer"):
+                Scratch().decide(Bulb.SwitchOnCommand())
+
+        summary = profiler.summary()
+        inner = summary["Scratch.decide:Bulb.SwitchOnCommand"]
+        self.assertGreaterEqual(inner.peak_bytes, 100_000)
+        self.assertLess(inner.retained_bytes, 10_000)
+        self.assertGreaterEqual(summary["outer"].peak_bytes, 100_000)
+
+    def test_messages_may_be_passed_by_keyword(self):
+        with profiling.enabled() as profiler:
+            InMemoryDecider(Bulb).decide(command=Bulb.FitCommand(max_uses=5))
+        self.assertIn("InMemoryDecider.decide:Bulb.FitCommand", profiler.summary())
+
+    def test_collapsed_stacks_nest_frames(self):
+        with profiling.enabled(profiling.Profiler(track_allocations=False)) as p:
+            decider = EventSourcingDecider(Bulb, "bulb")
+            decider.decide(Bulb.FitCommand(max_uses=5))
+            decider.decide(Bulb.SwitchOnCommand())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "profile.folded")
+        p.dump_collapsed(path)
+
+        with open(path, encoding="utf-8") as file:
+            stacks = dict(line.rsplit(" ", 1) for line in file.read().splitlines())
+        self.assertIn(
+            "EventSourcingDecider.decide:Bulb.SwitchOnCommand;fold;"
+            "Bulb.evolve:Bulb.FittedEvent",
+            stacks,
+        )
+        self.assertTrue(all(int(value) > 0 for value in stacks.values()))
+
+    def test_methods_are_only_wrapped_while_enabled(self):
+        decide = InMemoryDecider.__dict__["decide"]
+        self.assertFalse(hasattr(decide, "__profiled__"))
+        with profiling.enabled() as profiler:
+            self.assertTrue(InMemoryDecider.__dict__["decide"].__profiled__)
+
+            class Late:
+                @profiling.profiled("decide", 0)
+                def decide(self, command):
+                    return []
+
+            Late().decide(Bulb.SwitchOnCommand())
+        self.assertIs(InMemoryDecider.__dict__["decide"], decide)
+        self.assertFalse(hasattr(Late.__dict__["decide"], "__profiled__"))
+        self.assertIn("Late.decide:Bulb.SwitchOnCommand", profiler.summary())
+
+    def test_nothing_is_recorded_once_disabled(self):
+        with profiling.enabled() as profiler:
+            pass
+        InMemoryDecider(Bulb).decide(Bulb.FitCommand(max_uses=5))
+        self.assertIsNone(profiling.ACTIVE)
+        self.assertEqual(profiler.summary(), {})
+
+
+class SegmentTests(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        self.store.clock = iter(range(1000, 2000)).__next__
+        decider = EventSourcingDecider(Bulb, "bulb", self.store)
+        decider.decide(Bulb.FitCommand(max_uses=50))
+        for _ in range(20):
+            decider.decide(Bulb.SwitchOnCommand())
+            decider.decide(Bulb.SwitchOffCommand())
+        EventSourcingDecider(Bulb, "other", self.store).decide(
+            Bulb.FitCommand(max_uses=1)
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "events.segment")
+
+    def test_sealed_streams_load_back(self):
+        for compression in ("none", "zlib"):
+            with self.subTest(compression=compression):
+                segments.seal(self.store, self.path, bulb_event_serializer, compression)
+                segment = segments.SegmentEventStore(
+                    self.path, bulb_event_deserializer
+                )
+                self.assertEqual(segment.keys(), ["bulb", "other"])
+                for key in ("bulb", "other"):
+                    expected = self.store.load_stream(key)
+                    stream = segment.load_stream(key)
+                    self.assertEqual(stream.events, expected.events)
+                    self.assertEqual(stream.version, expected.version)
+                    self.assertEqual(stream.timestamps, expected.timestamps)
+                self.assertEqual(segment.load_stream("missing").version, 0)
+                self.assertEqual(segment.version_at("bulb", 1010), 11)
+
+    def test_append_times_round_trip_exactly(self):
+        store = file_based_event_store(
+            self, bulb_event_serializer, bulb_event_deserializer
+        )
+        decider = EventSourcingDecider(Bulb, "bulb", store)
+        decider.decide(Bulb.FitCommand(max_uses=50))
+        for _ in range(20):
+            decider.decide(Bulb.SwitchOnCommand())
+        segments.seal(store, self.path, bulb_event_serializer)
+        segment = segments.SegmentEventStore(self.path, bulb_event_deserializer)
+
+        timestamps = store.load_stream("bulb").timestamps
+        self.assertEqual(segment.load_stream("bulb").timestamps, timestamps)
+        for timestamp in timestamps:
+            for probe in (timestamp, timestamp - 1e-7, timestamp + 1e-7):
+                self.assertEqual(
+                    segment.version_at("bulb", probe), store.version_at("bulb", probe)
+                )
+
+    def test_any_append_times_round_trip(self):
+        timestamps = [-1e300, 1e300, 0.1, -0.0, 1e-300, 1_700_000_000.123456789]
+        with open(self.path, "wb") as file:
+            file.write(segments.encode({"bulb": (["blew"] * 6, timestamps)}))
+        segment = segments.SegmentEventStore(self.path, bulb_event_deserializer)
+        loaded = segment.load_stream("bulb").timestamps
+        self.assertEqual([t.hex() for t in loaded], [t.hex() for t in timestamps])
+
+    def test_alternating_events_are_run_length_encoded(self):
+        size = segments.seal(self.store, self.path, bulb_event_serializer, "none")
+        self.assertLess(size, os.path.getsize(self.store.path) / 2)
+        self.assertEqual(segments._runs([0] + [1, 2] * 20), [1, 1, 0, 2, 20, 1, 2])
+        self.assertEqual(
+            segments._runs([0, 1, 2, 1, 2, 1, 2, 1]), [1, 1, 0, 2, 3, 1, 2, 1, 1, 1]
+        )
+
+    def test_read_all_resumes_from_position(self):
+        segments.seal(self.store, self.path, bulb_event_serializer)
+        segment = segments.SegmentEventStore(self.path, bulb_event_deserializer)
+        first = segment.read_all(0, 40)
+        rest = segment.read_all(first[-1].position, 100)
+        self.assertEqual(len(first) + len(rest), 42)
+        self.assertEqual(rest[-1].key, "other")
+        self.assertEqual(rest[-1].event, Bulb.FittedEvent(1))
+
+    def test_segments_are_read_only(self):
+        segments.seal(self.store, self.path, bulb_event_serializer)
+        segment = segments.SegmentEventStore(self.path, bulb_event_deserializer)
+        with self.assertRaises(RuntimeError):
+            segment.append_to_stream("bulb", 41, [Bulb.SwitchedOnEvent()])
+
+    def test_unavailable_compressions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            segments.seal(self.store, self.path, bulb_event_serializer, "lz4")
+        if segments.zstandard is None:
+            with self.assertRaises(ImportError):
+                segments.seal(self.store, self.path, bulb_event_serializer, "zstd")
+
+
 class CatAndBulbComposedTests(unittest.TestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -362,6 +1557,35 @@ class CatAndBulbComposedTests(unittest.TestCase):
                 # Then cat wakes up
                 self.assertEqual(result, [Cat.WokeUpEvent()])
 
+    def test_combined_state_evolve_keeps_the_other_side(self):
+        events = [
+            Cat.GotToSleepEvent(),
+            Bulb.FittedEvent(max_uses=5),
+            Bulb.SwitchedOnEvent(),
+        ]
+        for aggregate in (self.cat_and_bulb, self.cat_and_2_bulbs):
+            with self.subTest(aggregate=str(aggregate)):
+                state = aggregate.initial_state()
+                state_level = fold(lambda s, e: s.evolve(e), state, events)
+                class_level = fold(aggregate.evolve, state, events)
+
+                for result in (state_level, class_level):
+                    self.assertIsInstance(result, aggregate.CombinedState)
+                    self.assertEqual(result.decider_x_state, Cat.AsleepState())
+                    bulb_state = result.decider_y_state
+                    if aggregate is self.cat_and_2_bulbs:
+                        self.assertIsInstance(
+                            bulb_state.decider_y_state, Bulb.NotFittedState
+                        )
+                        bulb_state = bulb_state.decider_x_state
+                    self.assertEqual(bulb_state, Bulb.WorkingState("On", 4))
+
+    def test_combined_state_evolve_reuses_unchanged_state(self):
+        state = self.cat_and_bulb.CombinedState(Cat.AwakeState(), Bulb.BlownState())
+        self.assertIs(state.evolve(Bulb.SwitchedOnEvent()), state)
+        evolved = state.evolve(Cat.GotToSleepEvent())
+        self.assertIs(evolved.decider_y_state, state.decider_y_state)
+
     def test_combo(self) -> None:
         for decider in self.deciders:
             with self.subTest(decider=str(decider)):
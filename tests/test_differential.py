@@ -0,0 +1,270 @@
+"""Differential tests running random command sequences through every runner.
+
+Each scenario generates a long random sequence of commands, replays it against
+a reference fold and through every runner (including the optimised paths),
+and checks that all of them decide the same events and end in the same state.
+Throughput per runner is recorded along the way; set `HARNESS_REPORT=1` to
+print it, and `HARNESS_COMMANDS` to change the length of the sequences.
+"""
+
+import collections
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+from typing import Callable, Iterator
+
+from decider import compose_decider_aggregates
+from deciders.bulb import Bulb
+from deciders.cat import Cat
+from infra import (
+    EventSourcingDecider,
+    IdempotentDecider,
+    InMemoryDecider,
+    StateBasedDecider,
+)
+from serializers import (
+    bulb_deserializer,
+    bulb_event_deserializer,
+    bulb_event_serializer,
+    bulb_serializer,
+    cat_deserializer,
+    cat_event_deserializer,
+    cat_event_serializer,
+    cat_serializer,
+)
+
+COMMANDS = int(os.environ.get("HARNESS_COMMANDS", "300"))
+SEEDS = (0, 1, 2)
+THROUGHPUT: dict[str, list[float]] = collections.defaultdict(list)
+
+
+def cat_commands(rng: random.Random) -> Iterator[Cat.Command]:
+    while True:
+        yield rng.choice([Cat.WakeUpCommand(), Cat.GoToSleepCommand()])
+
+
+def bulb_commands(rng: random.Random) -> Iterator[Bulb.Command]:
+    while True:
+        roll = rng.random()
+        if roll < 0.1:
+            yield Bulb.FitCommand(max_uses=rng.randint(0, 20))
+        elif roll < 0.6:
+            yield Bulb.SwitchOnCommand()
+        else:
+            yield Bulb.SwitchOffCommand()
+
+
+def cat_and_bulb_commands(rng: random.Random) -> Iterator:
+    cats, bulbs = cat_commands(rng), bulb_commands(rng)
+    while True:
+        yield next(cats) if rng.random() < 0.3 else next(bulbs)
+
+
+def cat_and_bulb_event_serializer(event) -> str:
+    if isinstance(event, Cat.Event):
+        return f"cat:{cat_event_serializer(event)}"
+    return f"bulb:{bulb_event_serializer(event)}"
+
+
+def cat_and_bulb_event_deserializer(text: str):
+    decider, _, event = text.partition(":")
+    if decider == "cat":
+        return cat_event_deserializer(event)
+    return bulb_event_deserializer(event)
+
+
+def reference_fold(aggregate, state, events: list):
+    """Plain fold, independent of the short cuts taken by `infra.fold`."""
+    for event in events:
+        state = aggregate.evolve(state, event)
+    return state
+
+
+def fingerprint(state) -> tuple:
+    """Comparable view of a state, including states without `__eq__`."""
+    if hasattr(state, "decider_x_state"):
+        return (
+            "Combined",
+            fingerprint(state.decider_x_state),
+            fingerprint(state.decider_y_state),
+        )
+    return (type(state).__qualname__, tuple(sorted(vars(state).items())))
+
+
+class DifferentialHarness(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls) -> None:
+        super().tearDownClass()
+        if os.environ.get("HARNESS_REPORT"):
+            for name, rates in sorted(THROUGHPUT.items()):
+                print(
+                    f"{name:<40} {sum(rates) / len(rates):>10.0f} commands/s",
+                    file=sys.stderr,
+                )
+
+    def file_store(
+        self, serializer, deserializer
+    ) -> EventSourcingDecider.FileBasedEventStore:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = EventSourcingDecider.FileBasedEventStore(
+            os.path.join(directory.name, "events.log"),
+            serializer,
+            deserializer,
+            fsync=False,
+        )
+        self.addCleanup(store.close)
+        return store
+
+    def check(
+        self,
+        name: str,
+        aggregate,
+        commands: Callable[[random.Random], Iterator],
+        runners: Callable[[], dict[str, object]],
+    ) -> None:
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            generated = commands(rng)
+            sequence = [next(generated) for _ in range(COMMANDS)]
+
+            state = aggregate.initial_state()
+            history, expected_events = [], []
+            for command in sequence:
+                events = aggregate.decide(command, state)
+                history.extend(events)
+                expected_events.append(events)
+                state = reference_fold(aggregate, state, events)
+            replayed = reference_fold(aggregate, aggregate.initial_state(), history)
+            self.assertEqual(fingerprint(replayed), fingerprint(state))
+
+            for runner_name, runner in runners().items():
+                with self.subTest(seed=seed, runner=runner_name):
+                    started = time.perf_counter()
+                    if isinstance(runner, IdempotentDecider):
+                        produced = self.decide_with_retries(runner, sequence, rng)
+                    else:
+                        produced = [runner.decide(command) for command in sequence]
+                    elapsed = time.perf_counter() - started
+                    THROUGHPUT[f"{name}/{runner_name}"].append(len(sequence) / elapsed)
+
+                    self.assertEqual(produced, expected_events)
+                    self.assertEqual(fingerprint(runner.state), fingerprint(state))
+
+    def decide_with_retries(
+        self, runner: IdempotentDecider, sequence: list, rng: random.Random
+    ) -> list:
+        """Sends every command with its own id, each followed by a retry.
+
+        The retry repeats a random earlier command with the same id, which
+        must be answered with the events that command produced the first time
+        and must not change the state.
+        """
+        produced = []
+        for index, command in enumerate(sequence):
+            produced.append(runner.decide(command, command_id=f"command-{index}"))
+            retried = rng.randrange(index + 1)
+            self.assertEqual(
+                runner.decide(sequence[retried], command_id=f"command-{retried}"),
+                produced[retried],
+            )
+        return produced
+
+    def test_cat(self):
+        self.check(
+            "cat",
+            Cat,
+            cat_commands,
+            lambda: {
+                "in_memory": InMemoryDecider(Cat),
+                "state_based": StateBasedDecider(
+                    Cat, cat_serializer, cat_deserializer, {}, "cat"
+                ),
+                "state_based_sqlite": self.sqlite_runner(
+                    Cat, cat_serializer, cat_deserializer
+                ),
+                "event_sourcing": EventSourcingDecider(Cat, "cat"),
+                "event_sourcing_file": EventSourcingDecider(
+                    Cat,
+                    "cat",
+                    self.file_store(cat_event_serializer, cat_event_deserializer),
+                ),
+            },
+        )
+
+    def test_bulb(self):
+        self.check(
+            "bulb",
+            Bulb,
+            bulb_commands,
+            lambda: {
+                "in_memory": InMemoryDecider(Bulb),
+                "state_based": StateBasedDecider(
+                    Bulb, bulb_serializer, bulb_deserializer, {}, "bulb"
+                ),
+                "state_based_sqlite": self.sqlite_runner(
+                    Bulb, bulb_serializer, bulb_deserializer
+                ),
+                "event_sourcing": EventSourcingDecider(Bulb, "bulb"),
+                "event_sourcing_file": EventSourcingDecider(
+                    Bulb,
+                    "bulb",
+                    self.file_store(bulb_event_serializer, bulb_event_deserializer),
+                ),
+                "idempotent": IdempotentDecider(
+                    InMemoryDecider(Bulb),
+                    "bulb",
+                    IdempotentDecider.Index(max_size=COMMANDS),
+                ),
+            },
+        )
+
+    def test_cat_and_bulb(self):
+        aggregate = compose_decider_aggregates(Cat, Bulb)
+        self.check(
+            "cat_and_bulb",
+            aggregate,
+            cat_and_bulb_commands,
+            lambda: {
+                "in_memory": InMemoryDecider(aggregate),
+                "event_sourcing": EventSourcingDecider(aggregate, "cat_and_bulb"),
+                "idempotent": IdempotentDecider(
+                    EventSourcingDecider(aggregate, "cat_and_bulb"),
+                    "cat_and_bulb",
+                    IdempotentDecider.Index(max_size=COMMANDS),
+                ),
+                "event_sourcing_file": EventSourcingDecider(
+                    aggregate,
+                    "cat_and_bulb",
+                    self.file_store(
+                        cat_and_bulb_event_serializer, cat_and_bulb_event_deserializer
+                    ),
+                ),
+            },
+        )
+
+    def test_cat_and_two_bulbs(self):
+        aggregate = compose_decider_aggregates(
+            Cat, compose_decider_aggregates(Bulb, Bulb)
+        )
+        self.check(
+            "cat_and_2_bulbs",
+            aggregate,
+            cat_and_bulb_commands,
+            lambda: {
+                "in_memory": InMemoryDecider(aggregate),
+                "event_sourcing": EventSourcingDecider(aggregate, "cat_and_2_bulbs"),
+            },
+        )
+
+    def sqlite_runner(self, aggregate, serializer, deserializer) -> StateBasedDecider:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = StateBasedDecider.SQLiteStateStore(
+            os.path.join(directory.name, "states.db"), pool_size=1
+        )
+        self.addCleanup(store.close)
+        return StateBasedDecider(aggregate, serializer, deserializer, store, "key")